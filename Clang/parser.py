@@ -1,12 +1,44 @@
+import argparse
 import clang.cindex
-import yaml
+import json
+import os
 import sys
-from collections import defaultdict
+import threading
+from collections import Counter, defaultdict, namedtuple
+from ctypes import byref, c_void_p, cast
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import re
-from functools import cache
+from functools import wraps
+from itertools import islice, repeat
+from pathlib import Path
+
+from clang.cindex import c_object_p
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from Common import binformat, emitter, instrument, server
+from Common.ir import (
+    Declaration,
+    Declarator,
+    Enumerator,
+    Parameter,
+    Pointer,
+    Type,
+    int_value,
+    leaf_type,
+)
+from Common.result_cache import ResultCache, parser_version
+from tu_cache import (
+    DEFAULT_MAX_BYTES,
+    TUCache,
+    TUMemoryCache,
+    clang_version,
+    include_closure,
+)
 
 clang.cindex.Config.set_library_file("/usr/lib/x86_64-linux-gnu/libclang-17.so.1")
 
+HEADER_SUFFIXES = {".h", ".hh", ".hpp", ".hxx"}
+
 THAPI_types = {
     clang.cindex.TypeKind.VOID: {"kind": "void"},
     clang.cindex.TypeKind.FLOAT: {"kind": "float"},
@@ -27,226 +59,379 @@ THAPI_types = {
 }
 
 
-def to_THAPI(self):
-    return THAPI_types[self.kind]
+def to_THAPI(t):
+    # Interned: every use of a builtin shares one immutable node
+    return leaf_type(**THAPI_types[t.kind])
+
+
+# Names of the functions decorated with memoize_decl/memoize_type
+memoized_decls = []
+
+# Parse options of the allowed-files mode: bodies and missing includes are irrelevant
+RESTRICTED_PARSE_OPTIONS = (
+    clang.cindex.TranslationUnit.PARSE_SKIP_FUNCTION_BODIES
+    | clang.cindex.TranslationUnit.PARSE_INCOMPLETE
+)
+
+
+def decl_key(c):
+    """Identity of a declaration that is stable across its redeclarations."""
+    return c.get_usr() or c.hash
+
+
+def type_key(t):
+    """Identity of a type within its translation unit.
+
+    libclang hands out uniqued QualType pointers, so equal types carry the same
+    data[0]; reading it does not call into libclang.
+    """
+    return t.data[0]
+
 
-clang.cindex.Type.to_THAPI = to_THAPI
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "currsize"])
 
 
-def match_typedef(target_node, potential_typedef_node):
-    A = potential_typedef_node.kind == clang.cindex.CursorKind.TYPEDEF_DECL
-    B = (
-        target_node.spelling
-        == potential_typedef_node.underlying_typedef_type.get_declaration().spelling
+def memoize(key_func):
+    """Cache the node built for a cursor or type in the ParseContext, keyed by key_func.
+
+    The returned nodes are shared between every reference to the declaration
+    or type, so callers must treat them as read-only. Caches belong to the
+    context, so they last as long as its translation unit.
+    """
+
+    def decorator(f):
+        name = f.__name__
+
+        @wraps(f)
+        def wrapper(ctx, t):
+            memo = ctx.memos[name]
+            key = key_func(t)
+            # f runs outside any handler, so its errors are not chained to a KeyError
+            if (d := memo.get(key)) is not None:
+                ctx.hits[name] += 1
+                return d
+            d = memo[key] = f(ctx, t)
+            ctx.misses[name] += 1
+            return d
+
+        memoized_decls.append(name)
+        return wrapper
+
+    return decorator
+
+
+memoize_decl = memoize(decl_key)
+memoize_type = memoize(type_key)
+
+
+def location_file(cursor):
+    """libclang file handle of the cursor's location, NULL for built-in declarations.
+
+    Handles are unique per file within a translation unit, and cheaper to
+    compare than cursor.location.file names.
+    """
+    lib = clang.cindex.conf.lib
+    f = c_object_p()
+    lib.clang_getInstantiationLocation(
+        lib.clang_getCursorLocation(cursor), byref(f), None, None, None
     )
-    return A and B
+    return f
 
 
-def merge_typedef(target, typedef):
-    return {
-        "kind": "declaration",
-        "storage": ":typedef",
-        "type": target["type"],
-        "declarators": typedef["declarators"],
-    }
+class FileFilter:
+    """Decide from a cursor's raw location whether it comes from an allowed file.
+
+    The main file is always allowed; allowed_paths are files or directories.
+    Verdicts are cached per libclang file handle, so each file name is resolved
+    once per translation unit.
+    """
+
+    def __init__(self, main_file, allowed_paths=()):
+        self.main_file = os.path.abspath(main_file)
+        self.allowed = [os.path.abspath(p) for p in allowed_paths]
+        self.by_file = {}
+
+    def allows_name(self, name):
+        name = os.path.abspath(name)
+        return name == self.main_file or any(
+            name == p or name.startswith(p + os.sep) for p in self.allowed
+        )
+
+    def allows(self, cursor):
+        f = location_file(cursor)
+        if not f:
+            return False
+        key = cast(f, c_void_p).value
+        try:
+            return self.by_file[key]
+        except KeyError:
+            allowed = self.by_file[key] = self.allows_name(clang.cindex.File(f).name)
+            return allowed
+
+
+class ParseContext:
+    """State of the conversion of one translation unit.
+
+    It holds the TranslationUnit, the FileFilter of the allowed files (None to
+    walk everything), the typedefs naming each declaration and the caches of
+    memoize_decl/memoize_type. Every conversion function takes it first and
+    nothing is kept at module level, so translation units can be converted
+    from several threads at once, one context each.
+    """
+
+    def __init__(self, tu, path=None, allowed_paths=None):
+        self.tu = tu
+        self.file_filter = None
+        if allowed_paths is not None:
+            self.file_filter = FileFilter(path or tu.spelling, allowed_paths)
+        # Memoized function name -> {cursor or type key: node}
+        self.memos = defaultdict(dict)
+        self.hits = Counter()
+        self.misses = Counter()
+        with instrument.phase("index"):
+            # Declaration key -> typedefs naming it
+            self.typedef_index = build_typedef_index(self, tu.cursor)
+
+    def cache_info(self):
+        """Hit/miss counts of the declaration and type caches, by function name."""
+        return {
+            name: CacheInfo(self.hits[name], self.misses[name], len(self.memos[name]))
+            for name in memoized_decls
+        }
 
 
-def extract_match(c):
-    return next(
-        (parse_typedef_decl(c2) for c2 in t.get_children() if match_typedef(c, c2)),
-        None,
+def get_children(ctx, c):
+    """Children of c, restricted to the allowed files when ctx has a file_filter.
+
+    Every child still becomes a Python cursor (the argument type of the
+    visitor callback) and costs two libclang calls to find its file, whose
+    verdict is cached. What the filter saves is the rest: rejected
+    declarations are neither converted nor descended into, and the parse
+    skips function bodies.
+    """
+    if (file_filter := ctx.file_filter) is None:
+        return c.get_children()
+
+    def visitor(child, parent, children):
+        if file_filter.allows(child):
+            child._tu = c._tu
+            children.append(child)
+        return 1  # CXChildVisit_Continue
+
+    children = []
+    clang.cindex.conf.lib.clang_visitChildren(
+        c, clang.cindex.callbacks["cursor_visit"](visitor), children
     )
+    return iter(children)
+
+
+def build_typedef_index(ctx, t, index=None):
+    """Map each declaration's key to the TYPEDEF_DECL cursors naming it, in source order."""
+    if index is None:
+        index = defaultdict(list)
+    for c in get_children(ctx, t):
+        match c.kind:
+            case clang.cindex.CursorKind.TYPEDEF_DECL:
+                d = c.underlying_typedef_type.get_declaration()
+                if d.kind != clang.cindex.CursorKind.NO_DECL_FOUND:
+                    index[decl_key(d)].append(c)
+            case (
+                clang.cindex.CursorKind.NAMESPACE
+                | clang.cindex.CursorKind.UNEXPOSED_DECL
+            ):
+                build_typedef_index(ctx, c, index)
+    return index
+
+
+def merge_typedef(target, typedef):
+    return Declaration(target.type, typedef.declarators, storage=":typedef")
+
+
+def extract_match(ctx, c):
+    if typedefs := ctx.typedef_index.get(decl_key(c)):
+        return parse_typedef_decl(ctx, typedefs[0])
+    return None
 
 
-def parse_translation_unit(t):
-    # d_entities = defaultdict(list)
-    entities = []
-    for c in t.get_children():
-        if c.location.is_in_system_header:
+def iter_translation_unit(ctx, t):
+    """Yield the entities of t one at a time, descending into namespaces."""
+    for _, entity in iter_cursor_entities(ctx, t):
+        yield entity
+
+
+def iter_cursor_entities(ctx, t):
+    """Yield (cursor, entity) for the entities of t, the cursor each one comes from."""
+    for c in get_children(ctx, t):
+        # Macro cursors only show up in TUs parsed with a detailed preprocessing record
+        if c.kind.is_preprocessing() or c.location.is_in_system_header:
             continue
-        # entities = d_entities[str(c.location.file)]
         match k := c.kind:
             case clang.cindex.CursorKind.FUNCTION_DECL:
-                entities.append(parse_function_decl(c))
+                yield c, parse_function_decl(ctx, c)
             case clang.cindex.CursorKind.TYPEDEF_DECL:
                 if c.underlying_typedef_type.get_declaration().kind not in [
                     clang.cindex.CursorKind.STRUCT_DECL,
                     clang.cindex.CursorKind.ENUM_DECL,
                     clang.cindex.CursorKind.UNION_DECL,
                 ]:
-                    entities.append(parse_typedef_decl(c))
+                    yield c, parse_typedef_decl(ctx, c)
             case clang.cindex.CursorKind.STRUCT_DECL:
-                dict_struct = parse_struct_decl(c)
+                dict_struct = parse_struct_decl(ctx, c)
                 # Check if the struct is typedef. If yes, need to modify the dict
-                dict_typedef = extract_match(c)
+                dict_typedef = extract_match(ctx, c)
                 if dict_typedef:
                     dict_struct = merge_typedef(dict_struct, dict_typedef)
-                entities.append(dict_struct)
+                yield c, dict_struct
             case clang.cindex.CursorKind.ENUM_DECL:
-                dict_enum = parse_enum_decl(c)
+                dict_enum = parse_enum_decl(ctx, c)
                 # Check if the enum is typedef. If yes, need to modify the dict
-                dict_typedef = extract_match(c)
+                dict_typedef = extract_match(ctx, c)
                 if dict_typedef:
                     dict_enum = merge_typedef(dict_enum, dict_typedef)
-                entities.append(dict_enum)
+                yield c, dict_enum
             case clang.cindex.CursorKind.UNION_DECL:
-                dict_union = parse_union_decl(c)
+                dict_union = parse_union_decl(ctx, c)
                 # Check if the enum is typedef. If yes, need to modify the dict
-                dict_typedef = extract_match(c)
+                dict_typedef = extract_match(ctx, c)
                 if dict_typedef:
                     dict_union = merge_typedef(dict_union, dict_typedef)
-                entities.append(dict_union)
-            case clang.cindex.CursorKind.NAMESPACE | clang.cindex.CursorKind.UNEXPOSED_DECL:
-                if d_list := parse_translation_unit(c):
-                    entities += d_list
+                yield c, dict_union
+            case (
+                clang.cindex.CursorKind.NAMESPACE
+                | clang.cindex.CursorKind.UNEXPOSED_DECL
+            ):
+                yield from iter_cursor_entities(ctx, c)
             case _:
                 raise NotImplementedError(f"parse_translation_unit: #{k}")
-    return {"kind": "translation_unit", "entities": entities}
-    # return {"kind": "translation_unit", "entities": dict(d_entities)}
 
 
-def parse_type_decl(t):
+def parse_translation_unit(ctx, t):
+    return {"kind": "translation_unit", "entities": list(iter_translation_unit(ctx, t))}
+
+
+@memoize_type
+def parse_type_decl(ctx, t):
     match k := t.kind:
         case clang.cindex.TypeKind.ELABORATED:
             d = t.get_declaration()
             match ke := d.kind:
                 case clang.cindex.CursorKind.TYPEDEF_DECL:
-                    return {"kind": "custom_type", "name": d.spelling}
+                    return leaf_type("custom_type", name=d.spelling)
                 case clang.cindex.CursorKind.STRUCT_DECL:
-                    return parse_struct_decl(d)["type"]
+                    return parse_struct_decl(ctx, d).type
                 case clang.cindex.CursorKind.ENUM_DECL:
-                    return parse_enum_decl(d)["type"]
+                    return parse_enum_decl(ctx, d).type
                 case clang.cindex.CursorKind.UNION_DECL:
-                    return parse_union_decl(d)["type"]
+                    return parse_union_decl(ctx, d).type
                 case _:
                     raise NotImplementedError(f"parse_type_ELABORATED: #{ke}")
-        case type_name if type_name in list(THAPI_types.keys()):
-            return t.to_THAPI()
+        case type_name if type_name in THAPI_types:
+            return to_THAPI(t)
         case clang.cindex.TypeKind.POINTER:
-            return parse_type_decl(t.get_pointee())
+            return parse_type_decl(ctx, t.get_pointee())
         case clang.cindex.TypeKind.INCOMPLETEARRAY:
             if t.element_type.kind in [
                 clang.cindex.TypeKind.INCOMPLETEARRAY,
                 clang.cindex.TypeKind.CONSTANTARRAY,
             ]:
-                return {
-                    "kind": "array",
-                    "type": parse_type_decl(t.element_type),
-                }
+                return Type("array", type=parse_type_decl(ctx, t.element_type))
             else:
-                return {"kind": "array"}
+                return Type("array")
         case clang.cindex.TypeKind.CONSTANTARRAY:
             if t.element_type.kind in [
                 clang.cindex.TypeKind.INCOMPLETEARRAY,
                 clang.cindex.TypeKind.CONSTANTARRAY,
             ]:
-                return {
-                    "kind": "array",
-                    "type": parse_type_decl(t.element_type),
-                    "length": parse_val(t.element_count),
-                }
+                return Type(
+                    "array",
+                    type=parse_type_decl(ctx, t.element_type),
+                    length=parse_val(t.element_count),
+                )
             else:
-                return {"kind": "array", "length": parse_val(t.element_count)}
+                return Type("array", length=parse_val(t.element_count))
         case _:
             raise NotImplementedError(
                 f"parse_type: #{k}\nfile: {t.translation_unit.spelling}"
             )
 
 
-def parse_type_param(t):
+@memoize_type
+def parse_type_param(ctx, t):
     match k := t.kind:
         case clang.cindex.TypeKind.ELABORATED:
             d = t.get_declaration()
             match ke := d.kind:
                 case clang.cindex.CursorKind.TYPEDEF_DECL:
-                    return {"kind": "custom_type", "name": d.spelling}
+                    return leaf_type("custom_type", name=d.spelling)
                 case clang.cindex.CursorKind.STRUCT_DECL:
-                    return {"kind": "struct", "name": d.spelling}
+                    return leaf_type("struct", name=d.spelling)
                 case clang.cindex.CursorKind.ENUM_DECL:
-                    return {"kind": "enum", "name": d.spelling}
+                    return leaf_type("enum", name=d.spelling)
                 case clang.cindex.CursorKind.UNION_DECL:
-                    return {"kind": "union", "name": d.spelling}
+                    return leaf_type("union", name=d.spelling)
                 case _:
                     raise NotImplementedError(f"parse_type_ELABORATED: #{ke}")
-        case type_name if type_name in list(THAPI_types.keys()):
-            return t.to_THAPI()
+        case type_name if type_name in THAPI_types:
+            return to_THAPI(t)
         case clang.cindex.TypeKind.POINTER:
-            return {"kind": "pointer", "type": parse_type_param(t.get_pointee())}
+            return Pointer(parse_type_param(ctx, t.get_pointee()))
         case clang.cindex.TypeKind.INCOMPLETEARRAY:
-            return {"kind": "array", "type": parse_type_param(t.element_type)}
+            return Type("array", type=parse_type_param(ctx, t.element_type))
         case clang.cindex.TypeKind.CONSTANTARRAY:
-            return {
-                "kind": "array",
-                "type": parse_type_param(t.element_type),
-                "length": parse_val(t.element_count),
-            }
+            return Type(
+                "array",
+                type=parse_type_param(ctx, t.element_type),
+                length=parse_val(t.element_count),
+            )
         case _:
             raise NotImplementedError(
                 f"parse_type: #{k}\nfile: {t.translation_unit.spelling}"
             )
 
 
-def parse_parameter(t):
-    return {
-        "kind": "parameter",
-        "type": parse_type_param(t.type),
-        "name": t.spelling,
-    }
+def parse_parameter(ctx, t):
+    return Parameter(parse_type_param(ctx, t.type), t.spelling)
 
 
-def parse_typedef_decl(t):
+def parse_typedef_decl(ctx, t):
     type_node = t.underlying_typedef_type
-    return {
-        "kind": "declaration",
-        "storage": ":typedef",
-        "type": parse_type_decl(type_node),
-        "declarators": [
-            {"kind": "declarator"}
-            | parse_pointer(type_node, "typedef")
-            | {"name": t.spelling}
-        ],
-    }
+    return Declaration(
+        parse_type_decl(ctx, type_node),
+        [Declarator(t.spelling, parse_pointer(type_node))],
+        storage=":typedef",
+    )
 
 
-def parse_function_decl(t):
+def parse_function_decl(ctx, t):
     type_node = t.type.get_result()
-    params_d = {}
-    if params := [parse_parameter(a) for a in t.get_arguments() if not a.kind.is_attribute()]:
-        params_d = {"params": params}
-    return {
-        "kind": "declaration",
-        "type": parse_type_decl(type_node),
-        "declarators": [
-            {
-                "kind": "declarator",
-                "indirect_type": {"kind": "function"}
-                | parse_pointer(type_node, "func")
-                | params_d,
-                "name": t.spelling,
-            },
+    params = [
+        parse_parameter(ctx, a) for a in t.get_arguments() if not a.kind.is_attribute()
+    ]
+    return Declaration(
+        parse_type_decl(ctx, type_node),
+        [
+            Declarator(
+                t.spelling,
+                Type("function", type=parse_pointer(type_node), params=params or None),
+            ),
         ],
-    }
+    )
 
 
-def parse_pointer(t, form):
+def parse_pointer(t):
+    """The chain of Pointer nodes of a pointer type, None for other types."""
     if t.kind == clang.cindex.TypeKind.POINTER:
-        ptr_dict = {"kind": "pointer"}
+        ptr = Pointer()
         type_node = t.get_pointee()
         while type_node.kind == clang.cindex.TypeKind.POINTER:
-            ptr_dict = {"kind": "pointer", "type": ptr_dict}
+            ptr = Pointer(ptr)
             type_node = type_node.get_pointee()
-        match form:
-            case "func":
-                return {"type": ptr_dict}
-            case "typedef" | "struct" | "enum":
-                return {"indirect_type": ptr_dict}
-            case _:
-                raise NotImplementedError(f"parse_pointer form: #{form}")
+        return ptr
     else:
-        return {}
+        return None
 
 
-def parse_field(t):
+def parse_field(ctx, t):
     match k := t.type.kind:
         case (
             clang.cindex.TypeKind.INCOMPLETEARRAY | clang.cindex.TypeKind.CONSTANTARRAY
@@ -257,28 +442,16 @@ def parse_field(t):
                 clang.cindex.TypeKind.CONSTANTARRAY,
             ]:
                 type_node = type_node.element_type
-            return {
-                "kind": "declaration",
-                "type": parse_type_decl(type_node.element_type),
-                "declarators": [
-                    {
-                        "kind": "declarator",
-                        "indirect_type": parse_type_decl(t.type),
-                        "name": t.spelling,
-                    }
-                ],
-            }
+            return Declaration(
+                parse_type_decl(ctx, type_node.element_type),
+                [Declarator(t.spelling, parse_type_decl(ctx, t.type))],
+            )
         case _:
             # print(t.location)
-            return {
-                "kind": "declaration",
-                "type": parse_type_decl(t.type),
-                "declarators": [
-                    {"kind": "declarator"}
-                    | parse_pointer(t.type, "struct")
-                    | {"name": t.spelling}
-                ],
-            }
+            return Declaration(
+                parse_type_decl(ctx, t.type),
+                [Declarator(t.spelling, parse_pointer(t.type))],
+            )
 
 
 def extract_name(t):
@@ -287,95 +460,842 @@ def extract_name(t):
     return None
 
 
-def parse_struct_decl(t):
-    members_d = {}
-    if members := [parse_field(a) for a in t.type.get_fields()]:
-        members_d = {"members": members}
-    name_d = {}
-    if name := extract_name(t):
-        name_d = {"name": name}
-    return {
-        "kind": "declaration",
-        "type": {"kind": "struct"} | name_d | members_d,
-    }
+@memoize_decl
+def parse_struct_decl(ctx, t):
+    members = [parse_field(ctx, a) for a in t.type.get_fields()]
+    return Declaration(
+        Type("struct", name=extract_name(t) or None, members=members or None)
+    )
 
 
 def parse_val(v, hex=False):
-    hex_dict = {}
-    if hex:
-        hex_dict = {"format": ":hex"}
-    if v < 0:
-        return {
-            "kind": "negative",
-            "expr": {"kind": "int_literal"} | hex_dict | {"val": abs(v)},
-        }
-    else:
-        return {"kind": "int_literal"} | hex_dict | {"val": v}
+    return int_value(v, hex)
+
+
+# Punctuation that may come before the literal of an enumerator initializer
+LEADING_PUNCTUATION = {"+", "-", "("}
+
+
+def literal_is_hex(tokens):
+    """Tell whether the first literal of tokens is written in hexadecimal.
+
+    An identifier expanding a macro is followed into the macro definition. This
+    needs a TU parsed with PARSE_DETAILED_PROCESSING_RECORD (--macro-values);
+    otherwise libclang annotates the identifier as a plain reference.
+    """
+    for token in tokens:
+        match token.kind:
+            case clang.cindex.TokenKind.PUNCTUATION if (
+                token.spelling in LEADING_PUNCTUATION
+            ):
+                continue
+            case clang.cindex.TokenKind.LITERAL:
+                return token.spelling.startswith(("0x", "0X"))
+            case clang.cindex.TokenKind.IDENTIFIER:
+                c = token.cursor
+                if c.kind == clang.cindex.CursorKind.MACRO_INSTANTIATION and (
+                    d := c.referenced
+                ):
+                    # The first token of a macro definition is the macro name
+                    return literal_is_hex(islice(d.get_tokens(), 1, None))
+        return False
+    return False
 
-@cache
-def get_file_data(path):
-   with open(path, "r") as f:
-       return f.readlines()
 
 def is_hex(t):
-    source = get_file_data(t.location.file.name)
-    return re.search(r"=[\s+-]*0x", source[t.location.line - 1], re.IGNORECASE)
+    """Tell whether the initializer of the enumerator t is a hexadecimal literal.
+
+    Only the tokens of the enumerator's own extent are looked at, so multi-line
+    initializers work and no file contents are kept around.
+    """
+    tokens = t.get_tokens()
+    for token in tokens:
+        if token.spelling == "=":
+            return literal_is_hex(tokens)
+    return False
+
 
 def parse_enum(t):
-    return {
-        "kind": "enumerator",
-        "name": t.spelling,
-        "val": parse_val(t.enum_value, is_hex(t)),
-    }
+    return Enumerator(t.spelling, parse_val(t.enum_value, is_hex(t)))
 
 
-def parse_enum_decl(t):
-    members_d = {}
-    if members := [parse_enum(a) for a in t.get_children() if not a.kind.is_attribute()]:
-        members_d = {"members": members}
-    name_d = {}
-    if name := extract_name(t):
-        name_d = {"name": name}
-    return {
-        "kind": "declaration",
-        "type": {"kind": "enum"}
-        | name_d
-        | members_d,
-    }
+@memoize_decl
+def parse_enum_decl(ctx, t):
+    members = [parse_enum(a) for a in t.get_children() if not a.kind.is_attribute()]
+    return Declaration(
+        Type("enum", name=extract_name(t) or None, members=members or None)
+    )
+
+
+@memoize_decl
+def parse_union_decl(ctx, t):
+    members = [
+        parse_field(ctx, a) for a in t.type.get_fields() if not a.kind.is_attribute()
+    ]
+    return Declaration(
+        Type("union", name=extract_name(t) or None, members=members or None)
+    )
+
+
+def write_output(d, stream, dumper, streaming=False):
+    # A document already rendered: YAML from the result cache, or binary
+    if isinstance(d, (str, bytes)):
+        stream.write(d)
+    elif streaming:
+        emitter.write_translation_unit(d["entities"], stream, dumper)
+    else:
+        emitter.write(d, stream, dumper)
+
+
+# Partition of the declarations without a file (compiler built-ins)
+BUILTIN_PARTITION = "<built-in>"
+
 
+class PartitionWriter:
+    """Write the entities of a translation unit as one document per originating file.
 
-def parse_union_decl(t):
-    members_d = {}
-    if members := [parse_field(a) for a in t.type.get_fields() if not a.kind.is_attribute()]:
-        members_d = {"members": members}
-    name_d = {}
-    if name := extract_name(t):
-        name_d = {"name": name}
+    Entities arrive in source order. A file's partition is complete once the
+    traversal leaves it for a file it does not include, and is written then;
+    its includers stay open until the traversal comes back out of them. A
+    file whose declarations resume after that (included again without a
+    guard) gets them appended to its document.
+
+    index() describes every partition: its file, its document and, as
+    [start, end) ranges, the positions of its entities in the entity list of
+    the whole translation unit.
+    """
+
+    def __init__(self, tu, directory, dumper=emitter.BACKENDS["auto"]):
+        self.directory = Path(directory)
+        self.dumper = dumper
+        # File name -> name of the file including it
+        self.parents = {}
+        for inclusion in tu.get_includes():
+            self.parents.setdefault(inclusion.include.name, inclusion.source.name)
+        self.names = {}  # libclang file handle -> file name
+        self.partitions = {}  # file name -> index record, in order of appearance
+        self.pending = {}  # file name -> entity texts not written yet
+        self.written = set()  # files whose document exists
+        self.current = None
+        self.position = 0
+
+    def file_name(self, cursor):
+        if not (f := location_file(cursor)):
+            return BUILTIN_PARTITION
+        key = cast(f, c_void_p).value
+        try:
+            return self.names[key]
+        except KeyError:
+            name = self.names[key] = clang.cindex.File(f).name
+            return name
+
+    def enclosing_files(self, name):
+        """name and the files including it, up to the main file."""
+        files = set()
+        while name is not None and name not in files:
+            files.add(name)
+            name = self.parents.get(name)
+        return files
+
+    def add(self, cursor, entity):
+        name = self.file_name(cursor)
+        if name != self.current:
+            open_files = self.enclosing_files(name)
+            for other in [f for f in self.pending if f not in open_files]:
+                self.flush(other)
+            self.current = name
+        if (partition := self.partitions.get(name)) is None:
+            partition = self.partitions[name] = {
+                "file": name if name == BUILTIN_PARTITION else os.path.realpath(name),
+                "path": self.document_name(name),
+                "entities": 0,
+                "positions": [],
+            }
+        positions = partition["positions"]
+        if positions and positions[-1][1] == self.position:
+            positions[-1][1] += 1
+        else:
+            positions.append([self.position, self.position + 1])
+        partition["entities"] += 1
+        self.position += 1
+        self.pending.setdefault(name, []).append(
+            emitter.dump_entity(entity, self.dumper)
+        )
+
+    def document_name(self, name):
+        """File name of the document of a partition, unique within the directory."""
+        stem = "builtin" if name == BUILTIN_PARTITION else Path(name).stem
+        taken = {partition["path"] for partition in self.partitions.values()}
+        path, n = f"{stem}.yaml", 1
+        while path in taken:
+            n += 1
+            path = f"{stem}-{n}.yaml"
+        return path
+
+    def flush(self, name):
+        """Write the pending entities of a partition to its document."""
+        texts = self.pending.pop(name)
+        path = self.directory / self.partitions[name]["path"]
+        if name in self.written:
+            # The entities sequence ends the document, so it goes on
+            with open(path, "a") as f:
+                f.writelines(texts)
+        else:
+            with open(path, "w") as f:
+                emitter.write_entity_texts(texts, f)
+            self.written.add(name)
+
+    def close(self):
+        for name in list(self.pending):
+            self.flush(name)
+
+    def index(self):
+        return {"entities": self.position, "partitions": list(self.partitions.values())}
+
+
+def write_partitions(
+    ctx, directory, dumper=emitter.BACKENDS["auto"], header=None, args=()
+):
+    """Write each originating file's entities of ctx.tu to its own document in directory.
+
+    directory/index.json, written last, lists the partitions (see PartitionWriter).
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    writer = PartitionWriter(ctx.tu, directory, dumper)
+    with instrument.phase("convert_and_dump"):
+        for cursor, entity in iter_cursor_entities(ctx, ctx.tu.cursor):
+            writer.add(cursor, entity)
+        writer.close()
+    index = {"header": header and os.path.abspath(header), "args": list(args)}
+    index |= writer.index()
+    (directory / "index.json").write_text(json.dumps(index, indent=1) + "\n")
+    return index
+
+
+def load_file(index, path, args=(), tu_cache=None, allowed_paths=None, parse_options=0):
+    """Parse one header with an existing Index into a ParseContext.
+
+    tu_cache is an optional TUCache used to skip reparsing unchanged include closures.
+    When allowed_paths is not None, only declarations from the header itself and
+    from those files or directories are visited. parse_options are extra
+    TranslationUnit.PARSE_* flags. An Index must not be used by several
+    threads at once.
+    """
+    options = parse_options
+    if allowed_paths is not None:
+        options |= RESTRICTED_PARSE_OPTIONS
+    with instrument.phase("parse"):
+        if tu_cache:
+            tu = tu_cache.parse(index, path, args, options)
+        else:
+            tu = index.parse(path, args=list(args), options=options)
+    # for w in tu.diagnostics:
+    #     print(f"WARNING: {w}")
+    return ParseContext(tu, path, allowed_paths)
+
+
+def iter_file(
+    index, path, args=(), tu_cache=None, allowed_paths=None, parse_options=0, stats=None
+):
+    """Parse one header with an existing Index and yield its entities as they are built.
+
+    stats, when given, receives the cache_info() of the conversion once it is done.
+    """
+    ctx = load_file(index, path, args, tu_cache, allowed_paths, parse_options)
+    yield from iter_translation_unit(ctx, ctx.tu.cursor)
+    if stats is not None:
+        stats.update(ctx.cache_info())
+
+
+def make_result_cache(directory, max_bytes=DEFAULT_MAX_BYTES):
+    """ResultCache for this parser: its version covers the sources and libclang."""
+    here = Path(__file__).resolve().parent
+    common = here.parent / "Common"
+    # emitter.py writes the cached documents
+    sources = [__file__, here / "tu_cache.py", common / "ir.py", common / "emitter.py"]
+    version = parser_version(sources, libclang=clang_version())
+    return ResultCache(directory, "clang", version, max_bytes)
+
+
+def result_settings(args, allowed_paths, parse_options):
+    """Everything besides the include set that the entities of a header depend on."""
     return {
-        "kind": "declaration",
-        "type": {"kind": "union"} | name_d | members_d,
+        "args": list(args),
+        "allowed_paths": allowed_paths and sorted(map(os.path.abspath, allowed_paths)),
+        "options": parse_options,
     }
 
 
-if __name__ == "__main__":
-    f = open(sys.argv[1])
-    source = f.readlines()
+def parse_file(
+    index,
+    path,
+    args=(),
+    tu_cache=None,
+    allowed_paths=None,
+    parse_options=0,
+    result_cache=None,
+    stats=None,
+):
+    """Parse one header with an existing Index into a translation_unit dict.
 
-    t = clang.cindex.Index.create().parse(sys.argv[1], args=sys.argv[2:]).cursor
-    # for w in t.diagnostics:
-    #     print(f"WARNING: {w}")
-    d = parse_translation_unit(t)
-    # Prevent yaml dumper from using anchors and aliases for repeated data in the yaml
-    # Done by monkey patching the ignore_aliases() function to always return True
-    yaml.Dumper.ignore_aliases = lambda *args: True
-    print(
-        yaml.dump(
-            d,
-            sort_keys=False,
-            explicit_start=True,
-            default_flow_style=False,
-        ).strip()
+    With a result_cache, a header whose include set did not change since it was
+    stored is not parsed at all. stats, when given, receives the cache_info()
+    of the conversion.
+    """
+    settings = result_settings(args, allowed_paths, parse_options)
+    if result_cache and (entities := result_cache.get(path, settings)) is not None:
+        return {"kind": "translation_unit", "entities": entities}
+    ctx = load_file(index, path, args, tu_cache, allowed_paths, parse_options)
+    with instrument.phase("convert"):
+        entities = list(iter_translation_unit(ctx, ctx.tu.cursor))
+    if result_cache:
+        result_cache.put(path, settings, entities, include_closure(ctx.tu, path))
+    if stats is not None:
+        stats.update(ctx.cache_info())
+    return {"kind": "translation_unit", "entities": entities}
+
+
+def expand_headers(paths):
+    """Expand directories into the headers they contain, keeping the given order."""
+    headers = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            headers += sorted(p for p in path.iterdir() if p.suffix in HEADER_SUFFIXES)
+        else:
+            headers.append(path)
+    return headers
+
+
+# libclang Index and caches owned by each process-pool worker
+worker_index = None
+worker_cache = None
+worker_results = None
+
+
+def init_worker(tu_cache, result_cache):
+    global worker_index, worker_cache, worker_results
+    worker_index = clang.cindex.Index.create()
+    worker_cache = tu_cache
+    worker_results = result_cache
+
+
+def parse_in_worker(header, args, allowed_paths, parse_options):
+    try:
+        return parse_file(
+            worker_index,
+            str(header),
+            args,
+            worker_cache,
+            allowed_paths,
+            parse_options,
+            worker_results,
+        )
+    except Exception as e:
+        return e
+
+
+def parse_batch(
+    headers,
+    args=(),
+    index=None,
+    jobs=1,
+    tu_cache=None,
+    allowed_paths=None,
+    lazy=False,
+    parse_options=0,
+    result_cache=None,
+    threads=1,
+    stats=None,
+):
+    """Yield (header, translation_unit dict or exception) for each header, in input order.
+
+    With jobs > 1 the headers are spread over a process pool where each worker
+    owns its own Index (and copies of tu_cache and result_cache). With
+    threads > 1 they are spread over a thread pool in this process, one Index
+    per thread, sharing tu_cache and result_cache. Otherwise they are parsed
+    here, sharing one Index. With lazy=True, serial runs yield dicts whose
+    "entities" is a generator: it must be consumed before the next header is
+    requested, and parse errors surface while consuming it. Results go through
+    result_cache whole, so it turns lazy off. stats, when given, maps each
+    header converted in this process to its cache_info().
+    """
+    if threads > 1 and len(headers) > 1:
+        yield from parse_threaded(
+            headers,
+            threads,
+            args,
+            tu_cache,
+            allowed_paths,
+            parse_options,
+            result_cache,
+            stats,
+        )
+        return
+    if jobs > 1 and len(headers) > 1:
+        with ProcessPoolExecutor(
+            min(jobs, len(headers)),
+            initializer=init_worker,
+            initargs=(tu_cache, result_cache),
+        ) as pool:
+            results = pool.map(
+                parse_in_worker,
+                headers,
+                repeat(args),
+                repeat(allowed_paths),
+                repeat(parse_options),
+            )
+            yield from zip(headers, results)
+        return
+    index = index or clang.cindex.Index.create()
+    for header in headers:
+        header_stats = None if stats is None else stats.setdefault(header, {})
+        if lazy and not result_cache:
+            entities = iter_file(
+                index,
+                str(header),
+                args,
+                tu_cache,
+                allowed_paths,
+                parse_options,
+                header_stats,
+            )
+            yield header, {"kind": "translation_unit", "entities": entities}
+            continue
+        try:
+            yield header, parse_file(
+                index,
+                str(header),
+                args,
+                tu_cache,
+                allowed_paths,
+                parse_options,
+                result_cache,
+                header_stats,
+            )
+        except Exception as e:
+            yield header, e
+
+
+def parse_threaded(
+    headers,
+    threads,
+    args=(),
+    tu_cache=None,
+    allowed_paths=None,
+    parse_options=0,
+    result_cache=None,
+    stats=None,
+):
+    """Yield (header, translation_unit dict or exception) for each header, in input order.
+
+    The headers are parsed by a pool of threads, each with its own Index and
+    a ParseContext per header. libclang runs without the GIL, so parsing
+    overlaps; the conversion itself is Python and takes turns. Unlike a
+    process pool, nothing is spawned or pickled.
+    """
+    local = threading.local()
+
+    def parse(header):
+        if (index := getattr(local, "index", None)) is None:
+            index = local.index = clang.cindex.Index.create()
+        header_stats = None if stats is None else stats.setdefault(header, {})
+        try:
+            return parse_file(
+                index,
+                str(header),
+                args,
+                tu_cache,
+                allowed_paths,
+                parse_options,
+                result_cache,
+                header_stats,
+            )
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(min(threads, len(headers))) as pool:
+        yield from zip(headers, pool.map(parse, headers))
+
+
+# YAML dumper of a --serve worker
+worker_dumper = None
+
+
+def init_server_worker(tu_cache, result_cache, yaml_backend):
+    """Set up a --serve worker, whose Index and caches stay warm between requests."""
+    global worker_dumper
+    init_worker(TUMemoryCache(tu_cache), result_cache)
+    worker_dumper = emitter.get_dumper(yaml_backend)
+
+
+def convert_request(request):
+    """The document answering a --serve request (see Common/server.py).
+
+    Besides header and args, a request may give allow_paths, as the
+    --allow-path options (present, even empty, it means --main-file-only), and
+    macro_values, as --macro-values.
+    """
+    header, args = request["header"], request.get("args", [])
+    allowed_paths = request.get("allow_paths")
+    parse_options = 0
+    if request.get("macro_values"):
+        parse_options = clang.cindex.TranslationUnit.PARSE_DETAILED_PROCESSING_RECORD
+    settings = result_settings(args, allowed_paths, parse_options)
+    binary = request.get("format") == "binary"
+    if worker_results and not binary:
+        if (document := worker_results.get_document(header, settings)) is not None:
+            return document
+    d = parse_file(
+        worker_index,
+        header,
+        args,
+        worker_cache,
+        allowed_paths,
+        parse_options,
+        worker_results,
+    )
+    if binary:
+        return binformat.dumps(d)
+    document = emitter.dump(d, worker_dumper) + "\n"
+    if worker_results:
+        worker_results.put_document(header, settings, document)
+    return document
+
+
+# Functions timed by --profile
+PROFILED_FUNCTIONS = [
+    "build_typedef_index",
+    "parse_function_decl",
+    "parse_typedef_decl",
+    "parse_struct_decl",
+    "parse_enum_decl",
+    "parse_union_decl",
+    "parse_type_decl",
+    "parse_type_param",
+    "parse_parameter",
+    "parse_pointer",
+    "parse_field",
+    "parse_enum",
+    "extract_match",
+    "extract_name",
+    "merge_typedef",
+    "is_hex",
+    "literal_is_hex",
+]
+
+
+def main(argv):
+    arg_parser = argparse.ArgumentParser(
+        description="Convert C/C++ headers to THAPI YAML.",
+        usage="%(prog)s [options] HEADER [CLANG_ARGS...]\n"
+        "       %(prog)s --batch [options] HEADER_OR_DIR... [-- CLANG_ARGS...]",
+    )
+    arg_parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="parse several headers (or directories of headers) in one process",
+    )
+    arg_parser.add_argument(
+        "-o",
+        "--output",
+        action="append",
+        default=[],
+        help="output path for the matching header, in order (batch mode)",
+    )
+    arg_parser.add_argument(
+        "--output-dir",
+        type=Path,
+        help="write <stem>.out for each header into this directory (batch mode)",
+    )
+    arg_parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="number of worker processes used to parse headers (batch mode)",
+    )
+    arg_parser.add_argument(
+        "--threads",
+        type=int,
+        default=1,
+        help="number of threads used to parse headers (batch mode), each with its "
+        "own libclang Index; parsing runs in parallel without spawning processes "
+        "or pickling results (not with --jobs)",
+    )
+    arg_parser.add_argument(
+        "--main-file-only",
+        action="store_true",
+        help="only visit declarations of the header itself (and of --allow-path), "
+        "skipping function bodies and tolerating incomplete translation units",
+    )
+    arg_parser.add_argument(
+        "--allow-path",
+        action="append",
+        default=[],
+        help="file or directory whose declarations are visited too (implies --main-file-only)",
+    )
+    arg_parser.add_argument(
+        "--macro-values",
+        action="store_true",
+        help="keep a detailed preprocessing record so that enumerators initialized "
+        "through macros keep the literal format (hex) of the macro",
+    )
+    arg_parser.add_argument(
+        "--tu-cache",
+        type=Path,
+        help="directory caching serialized translation units between runs",
+    )
+    arg_parser.add_argument(
+        "--tu-cache-size",
+        type=int,
+        default=DEFAULT_MAX_BYTES >> 20,
+        help="size cap of the TU cache in MiB, least recently used entries are evicted "
+        "(default: %(default)s)",
+    )
+    arg_parser.add_argument(
+        "--result-cache",
+        type=Path,
+        help="directory caching the entities of each header between runs; an "
+        "unchanged header and include set is not parsed again",
+    )
+    arg_parser.add_argument(
+        "--result-cache-size",
+        type=int,
+        default=DEFAULT_MAX_BYTES >> 20,
+        help="size cap of the result cache in MiB, least recently used entries are "
+        "evicted (default: %(default)s)",
     )
+    arg_parser.add_argument(
+        "--yaml-backend",
+        choices=emitter.BACKENDS,
+        default="auto",
+        help="YAML emitter, auto picks libyaml when available (default: %(default)s)",
+    )
+    arg_parser.add_argument(
+        "--yaml-aliases",
+        action="store_true",
+        help="write each repeated leaf type (builtins, custom types, tags by name) "
+        "in full once, then as a YAML alias (not with --partition-dir or --serve)",
+    )
+    arg_parser.add_argument(
+        "--format",
+        choices=server.FORMATS,
+        default="yaml",
+        help="output format: YAML, or the compact binary encoding of Common/binformat.py "
+        "(<stem>.bin with --output-dir) (default: %(default)s)",
+    )
+    arg_parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="write entities one by one instead of dumping the whole document at once",
+    )
+    arg_parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="print declaration cache statistics to stderr (not with --jobs)",
+    )
+    arg_parser.add_argument(
+        "--profile",
+        type=Path,
+        help="write call counts and times of the hot functions, libclang calls and "
+        "per-phase wall time and allocations to this JSON file, with a pstats dump "
+        f"next to it (serial runs only; also enabled by ${instrument.ENV_VAR})",
+    )
+    arg_parser.add_argument(
+        "--partition-dir",
+        type=Path,
+        help="write the entities of each originating file (e.g. every API header "
+        "of an umbrella header) to its own document in this directory, as soon "
+        "as the file is done, with an index.json of files and entity positions",
+    )
+    arg_parser.add_argument(
+        "--serve",
+        nargs="?",
+        const="",
+        metavar="SOCKET",
+        help="run as a daemon answering parse requests on this Unix socket "
+        "(default: one per user) with --jobs warm worker processes; "
+        "Common/client.py is its client",
+    )
+    arg_parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        help="with --serve, exit after this many seconds without requests",
+    )
+    arg_parser.add_argument("inputs", nargs=argparse.REMAINDER)
+    opts = arg_parser.parse_args(argv)
+    if opts.yaml_aliases and (opts.serve is not None or opts.partition_dir):
+        arg_parser.error(
+            "--yaml-aliases dumps whole documents, without --partition-dir or --serve"
+        )
+    if opts.serve is not None:
+        return serve(opts)
+    if not opts.inputs:
+        arg_parser.error("no header given")
+    if opts.jobs > 1 and opts.threads > 1:
+        arg_parser.error("--jobs and --threads are exclusive")
+    if profile := instrument.output_path(opts.profile):
+        if opts.jobs > 1 or opts.threads > 1:
+            arg_parser.error(
+                "--profile records serial runs only, not --jobs or --threads"
+            )
+        instrument.enable(globals(), PROFILED_FUNCTIONS, libclang=True)
+
+    if opts.batch:
+        inputs, clang_args = opts.inputs, []
+        if "--" in inputs:
+            i = inputs.index("--")
+            inputs, clang_args = inputs[:i], inputs[i + 1 :]
+        headers = expand_headers(inputs)
+    else:
+        headers, clang_args = [Path(opts.inputs[0])], opts.inputs[1:]
+
+    if opts.output and len(opts.output) != len(headers):
+        arg_parser.error(f"{len(opts.output)} outputs given for {len(headers)} headers")
+    if opts.output_dir:
+        opts.output_dir.mkdir(parents=True, exist_ok=True)
+    try:
+        dumper = emitter.get_dumper(opts.yaml_backend, opts.yaml_aliases)
+    except ValueError as e:
+        arg_parser.error(str(e))
+
+    tu_cache = (
+        TUCache(opts.tu_cache, opts.tu_cache_size << 20) if opts.tu_cache else None
+    )
+    result_cache = None
+    if opts.result_cache:
+        result_cache = make_result_cache(
+            opts.result_cache, opts.result_cache_size << 20
+        )
+    failed = 0
+    allowed_paths = opts.allow_path if opts.main_file_only or opts.allow_path else None
+    parse_options = 0
+    if opts.macro_values:
+        parse_options = clang.cindex.TranslationUnit.PARSE_DETAILED_PROCESSING_RECORD
+    if opts.partition_dir:
+        if len(headers) != 1:
+            arg_parser.error("--partition-dir takes a single header")
+        if opts.format != "yaml":
+            arg_parser.error("--partition-dir writes YAML documents only")
+        ctx = load_file(
+            clang.cindex.Index.create(),
+            str(headers[0]),
+            clang_args,
+            tu_cache,
+            allowed_paths,
+            parse_options,
+        )
+        write_partitions(ctx, opts.partition_dir, dumper, headers[0], clang_args)
+        if profile:
+            instrument.recorder.write(profile)
+        return 0
+    settings = result_settings(clang_args, allowed_paths, parse_options)
+    # Headers whose document is cached are neither parsed nor dumped again; only
+    # plain YAML documents are cached, the entities serve every format
+    cache_documents = result_cache and opts.format == "yaml" and not opts.yaml_aliases
+    documents = {}
+    if cache_documents:
+        for header in headers:
+            if (document := result_cache.get_document(header, settings)) is not None:
+                documents[header] = document
+    stats = {} if opts.stats else None
+    results = parse_batch(
+        [header for header in headers if header not in documents],
+        clang_args,
+        jobs=opts.jobs,
+        tu_cache=tu_cache,
+        allowed_paths=allowed_paths,
+        lazy=opts.stream,
+        parse_options=parse_options,
+        result_cache=result_cache,
+        threads=opts.threads,
+        stats=stats,
+    )
+    for i, header in enumerate(headers):
+        d = documents.get(header) or next(results)[1]
+        try:
+            if isinstance(d, Exception):
+                raise d
+            # Lazy (--stream) entities are converted while they are dumped
+            with instrument.phase("dump"):
+                if opts.format == "binary":
+                    d = binformat.dumps(d)
+                elif cache_documents and not isinstance(d, str):
+                    d = emitter.dump(d, dumper) + "\n"
+                    result_cache.put_document(header, settings, d)
+                binary = isinstance(d, bytes)
+                if opts.output or opts.output_dir:
+                    suffix = ".bin" if binary else ".out"
+                    out = (
+                        opts.output[i]
+                        if opts.output
+                        else opts.output_dir / f"{header.stem}{suffix}"
+                    )
+                    with open(out, "wb" if binary else "w") as f:
+                        write_output(d, f, dumper, opts.stream)
+                else:
+                    write_output(
+                        d,
+                        sys.stdout.buffer if binary else sys.stdout,
+                        dumper,
+                        opts.stream,
+                    )
+        except Exception as e:
+            if not opts.batch:
+                raise
+            print(f"{header}: {type(e).__name__}: {e}", file=sys.stderr)
+            failed += 1
+            continue
+        if stats and (info := stats.get(header)):
+            print(f"{header}: {info}", file=sys.stderr)
+    if opts.stats and tu_cache:
+        print(
+            f"TU cache: {tu_cache.hits} hits, {tu_cache.misses} misses", file=sys.stderr
+        )
+    if opts.stats and result_cache:
+        print(
+            f"result cache: {result_cache.hits} hits, {result_cache.misses} misses",
+            file=sys.stderr,
+        )
+    if profile:
+        instrument.recorder.write(profile)
+    return 1 if failed else 0
+
+
+def serve(opts):
+    """Run the --serve daemon until it is shut down."""
+    try:
+        emitter.get_dumper(opts.yaml_backend)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    tu_cache = (
+        TUCache(opts.tu_cache, opts.tu_cache_size << 20) if opts.tu_cache else None
+    )
+    result_cache = None
+    if opts.result_cache:
+        result_cache = make_result_cache(
+            opts.result_cache, opts.result_cache_size << 20
+        )
+    try:
+        server.serve(
+            opts.serve or server.default_socket_path("clang"),
+            "clang",
+            convert_request,
+            init_server_worker,
+            (tu_cache, result_cache, opts.yaml_backend),
+            jobs=opts.jobs,
+            idle_timeout=opts.idle_timeout,
+        )
+    except (RuntimeError, PermissionError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
 
 
 """TODO LIST
@@ -0,0 +1,143 @@
+"""
+On-disk cache of serialized libclang translation units.
+
+Each entry lives in its own directory, named after a hash of the header path,
+the compiler arguments, the parse options and the libclang version:
+
+    <cache dir>/<key>/tu.ast     TranslationUnit.save() output
+    <cache dir>/<key>/deps.json  every file of the include closure with its
+                                 mtime, size and content hash
+
+An entry is reused (through TranslationUnit.from_ast_file) only if no file of
+its include closure changed. libclang itself also rejects an AST whose inputs
+were touched, in which case the header is simply parsed and stored again.
+The mtime of deps.json records the last use, and the least recently used
+entries are evicted once the cache outgrows its cap.
+
+Long-lived processes (the --serve daemon) keep their translation units in a
+TUMemoryCache instead, checked the same way, in front of the on-disk cache.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+import clang.cindex
+
+from Common.disk_cache import (
+    DEFAULT_MAX_BYTES,
+    CacheDirectory,
+    file_record,
+    is_unchanged,
+)
+
+
+def clang_version():
+    get_version = clang.cindex.conf.lib.clang_getClangVersion
+    get_version.restype = clang.cindex._CXString
+    get_version.errcheck = clang.cindex._CXString.from_result
+    return get_version()
+
+
+def include_closure(tu, path):
+    """Absolute paths of the header and of every file it includes, sorted."""
+    files = {os.path.abspath(path)}
+    # Include paths such as <gcc dir>/../../include go through symlinks, which
+    # abspath would drop
+    files.update(os.path.realpath(i.include.name) for i in tu.get_includes())
+    return sorted(files)
+
+
+# Translation units a TUMemoryCache keeps alive
+DEFAULT_MAX_ENTRIES = 16
+
+
+class TUCache(CacheDirectory):
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        super().__init__(directory, max_bytes)
+        self._version = clang_version()
+
+    def entry_key(self, path, args, options):
+        # Relative paths in args depend on the working directory
+        key = json.dumps(
+            [os.path.abspath(path), os.getcwd(), list(args), options, self._version]
+        )
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def parse(self, index, path, args=(), options=0):
+        """Return the TranslationUnit for path, loading it from the cache when valid."""
+        entry = self.directory / self.entry_key(path, args, options)
+        if tu := self._load(index, entry):
+            self.hits += 1
+            return tu
+        self.misses += 1
+        tu = index.parse(path, args=list(args), options=options)
+        self._store(tu, entry, path)
+        return tu
+
+    def _load(self, index, entry):
+        manifest = entry / "deps.json"
+        try:
+            deps = json.loads(manifest.read_text())
+        except (OSError, ValueError):
+            return None
+        if not all(is_unchanged(dep) for dep in deps):
+            return None
+        try:
+            tu = clang.cindex.TranslationUnit.from_ast_file(entry / "tu.ast", index)
+        except clang.cindex.TranslationUnitLoadError:
+            return None
+        manifest.touch()
+        return tu
+
+    def _store(self, tu, entry, path):
+        entry.mkdir(exist_ok=True)
+        tmp = entry / f"tu.ast.{os.getpid()}.{threading.get_ident()}"
+        try:
+            tu.save(tmp)
+        except clang.cindex.TranslationUnitSaveError:
+            shutil.rmtree(entry, ignore_errors=True)
+            return
+        os.replace(tmp, entry / "tu.ast")
+        deps = [file_record(f) for f in include_closure(tu, path)]
+        (entry / "deps.json").write_text(json.dumps(deps))
+        self.evict()
+
+
+class TUMemoryCache:
+    """Translation units kept in memory and reused while their include closure is unchanged.
+
+    Misses are parsed through fallback (a TUCache) when one is given. The
+    least recently used translation units are dropped beyond max_entries.
+    """
+
+    def __init__(self, fallback=None, max_entries=DEFAULT_MAX_ENTRIES):
+        self.fallback = fallback
+        self.max_entries = max_entries
+        self.entries = (
+            OrderedDict()
+        )  # key -> (TranslationUnit, include closure records)
+        self.hits = 0
+        self.misses = 0
+
+    def parse(self, index, path, args=(), options=0):
+        """Return the TranslationUnit for path, reusing the one in memory when valid."""
+        # Relative paths in args depend on the working directory
+        key = (os.path.abspath(path), os.getcwd(), tuple(args), options)
+        entry = self.entries.pop(key, None)
+        if entry is not None and all(is_unchanged(dep) for dep in entry[1]):
+            self.entries[key] = entry
+            self.hits += 1
+            return entry[0]
+        self.misses += 1
+        if self.fallback:
+            tu = self.fallback.parse(index, path, args, options)
+        else:
+            tu = index.parse(path, args=list(args), options=options)
+        self.entries[key] = (tu, [file_record(f) for f in include_closure(tu, path)])
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return tu
@@ -0,0 +1,292 @@
+"""
+Compact binary encoding of the parser output, loaded much faster than YAML.
+
+A document is a flat table of nodes over an interned string pool. Every
+array is little-endian int32, so a file can be memory-mapped and read in
+place:
+
+    header    magic, version, root node, string count, node count, child count
+    strings   string_count + 1 offsets into the string data
+    nodes     node_count (tag, a, b) triples:
+                MAP    a = first child, b = entry count; children holds
+                       (key string, value node) pairs
+                LIST   a = first child, b = item count; children holds nodes
+                STR    a = string
+                INT    a = value
+                BIGINT a = string of the decimal value (beyond int32)
+                BOOL   a = 0 or 1
+                NULL
+    children  child_count node or string references
+    data      the UTF-8 strings, back to back
+
+Strings are stored once and structurally equal subtrees once (the
+{kind: int} of every int parameter is one node), which keeps files small.
+
+dumps() encodes the entities of a parser (IR nodes, dicts, lists, scalars).
+load() returns the same nested dicts and lists as loading the YAML, and
+Document reads the entities one by one without decoding the rest. Conversion
+is lossless both ways:
+
+    python3 -m Common.binformat to-binary header.yaml header.bin
+    python3 -m Common.binformat to-yaml header.bin header.yaml
+"""
+
+import argparse
+import mmap
+import struct
+import sys
+from array import array
+
+import yaml
+
+from Common import emitter
+from Common.ir import Node
+
+MAGIC = b"THAPIBIN"
+VERSION = 1
+HEADER = struct.Struct("<8sIIiiii")
+
+MAP, LIST, STR, INT, BIGINT, BOOL, NULL = range(7)
+INT32_MIN, INT32_MAX = -(1 << 31), (1 << 31) - 1
+# array typecode of the int32 tables
+INT32 = "i"
+
+SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+class Encoder:
+    """Build the string pool and node table of one document."""
+
+    def __init__(self):
+        self.strings = {}  # string -> id
+        self.nodes = array(INT32)
+        self.children = array(INT32)
+        self.interned = {}  # node contents -> node id
+        # id() of shared objects (memoized IR nodes) -> node id; values keeps them alive
+        self.by_object = {}
+        self.values = []
+
+    def string(self, s):
+        try:
+            return self.strings[s]
+        except KeyError:
+            i = self.strings[s] = len(self.strings)
+            return i
+
+    def node(self, tag, a=0, b=0, children=()):
+        key = (tag, a, b, *children)
+        try:
+            return self.interned[key]
+        except KeyError:
+            pass
+        if children:
+            a = len(self.children)
+            self.children.extend(children)
+        i = self.interned[key] = len(self.nodes) // 3
+        self.nodes.extend((tag, a, b))
+        return i
+
+    def encode(self, value):
+        """Node id of value, adding it and its contents to the table."""
+        if isinstance(value, (Node, dict, list)):
+            if (i := self.by_object.get(id(value))) is not None:
+                return i
+        match value:
+            case Node() | dict():
+                pairs = []
+                for key, item in value.items():
+                    pairs += (self.string(key), self.encode(item))
+                i = self.node(MAP, 0, len(pairs) // 2, pairs)
+            case str():
+                return self.node(STR, self.string(value))
+            case bool():
+                return self.node(BOOL, int(value))
+            case int() if INT32_MIN <= value <= INT32_MAX:
+                return self.node(INT, value)
+            case int():
+                return self.node(BIGINT, self.string(str(value)))
+            case None:
+                return self.node(NULL)
+            case list() | tuple():
+                items = [self.encode(item) for item in value]
+                i = self.node(LIST, 0, len(items), items)
+            case _:
+                raise TypeError(f"Unhandled value in encode(): #{type(value).__name__}")
+        if not isinstance(value, tuple):
+            self.by_object[id(value)] = i
+            self.values.append(value)
+        return i
+
+    def dumps(self, root) -> bytes:
+        data = [s.encode() for s in self.strings]
+        offsets = array(INT32, [0])
+        for s in data:
+            offsets.append(offsets[-1] + len(s))
+        header = HEADER.pack(
+            MAGIC,
+            VERSION,
+            0,
+            root,
+            len(data),
+            len(self.nodes) // 3,
+            len(self.children),
+        )
+        arrays = [offsets, self.nodes, self.children]
+        if sys.byteorder != "little":
+            arrays = [array(INT32, a) for a in arrays]
+            for a in arrays:
+                a.byteswap()
+        return b"".join([header, *(a.tobytes() for a in arrays), *data])
+
+
+def dumps(d) -> bytes:
+    """The binary document of d, a translation_unit dict (its entities may be lazy)."""
+    if isinstance(d, dict) and not isinstance(d.get("entities", []), list):
+        d = d | {"entities": list(d["entities"])}
+    encoder = Encoder()
+    root = encoder.encode(d)
+    return encoder.dumps(root)
+
+
+def write(d, stream):
+    stream.write(dumps(d))
+
+
+class Document:
+    """A binary document read in place from a buffer (bytes or a memory map).
+
+    Structurally equal subtrees are decoded once, so the dicts and lists
+    handed out may be shared and must be treated as read-only, like the IR.
+    """
+
+    def __init__(self, buffer):
+        header = HEADER.unpack_from(buffer)
+        magic, version, _, self.root, string_count, node_count, child_count = header
+        if magic != MAGIC:
+            raise ValueError("not a THAPI binary document")
+        if version != VERSION:
+            raise ValueError(f"unsupported THAPI binary version {version}")
+        view = memoryview(buffer)
+        start = HEADER.size
+        sections = []
+        for count in (string_count + 1, 3 * node_count, child_count):
+            end = start + 4 * count
+            sections.append(view[start:end].cast(INT32))
+            start = end
+        if sys.byteorder != "little":
+            sections = [array(INT32, s) for s in sections]
+            for s in sections:
+                s.byteswap()
+        self.offsets, self.nodes, self.children = sections
+        self.data = view[start:]
+        self.strings = [None] * string_count
+        self.decoded = {}
+
+    @classmethod
+    def open(cls, path):
+        with open(path, "rb") as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def string(self, i):
+        if (s := self.strings[i]) is None:
+            s = self.strings[i] = str(
+                self.data[self.offsets[i] : self.offsets[i + 1]], "utf-8"
+            )
+        return s
+
+    def value(self, i):
+        """The plain data of node i."""
+        try:
+            return self.decoded[i]
+        except KeyError:
+            pass
+        nodes, children = self.nodes, self.children
+        tag, a, b = nodes[3 * i], nodes[3 * i + 1], nodes[3 * i + 2]
+        match tag:
+            case 0:  # MAP
+                value = {
+                    self.string(children[j]): self.value(children[j + 1])
+                    for j in range(a, a + 2 * b, 2)
+                }
+            case 1:  # LIST
+                value = [self.value(children[j]) for j in range(a, a + b)]
+            case 2:  # STR
+                value = self.string(a)
+            case 3:  # INT
+                value = a
+            case 4:  # BIGINT
+                value = int(self.string(a))
+            case 5:  # BOOL
+                value = bool(a)
+            case 6:  # NULL
+                value = None
+            case _:
+                raise ValueError(f"Unhandled node tag in value(): #{tag}")
+        self.decoded[i] = value
+        return value
+
+    def load(self):
+        """The whole document, as yaml.safe_load() returns it for the YAML."""
+        return self.value(self.root)
+
+    def entity_nodes(self):
+        """Node ids of the items of the root's "entities" list."""
+        nodes, children = self.nodes, self.children
+        a, b = nodes[3 * self.root + 1], nodes[3 * self.root + 2]
+        for j in range(a, a + 2 * b, 2):
+            if self.string(children[j]) == "entities":
+                i = children[j + 1]
+                start, count = nodes[3 * i + 1], nodes[3 * i + 2]
+                return children[start : start + count]
+        raise KeyError("entities")
+
+    def __len__(self):
+        return len(self.entity_nodes())
+
+    def __getitem__(self, n):
+        """Entity n of the document, decoding only that entity."""
+        return self.value(self.entity_nodes()[n])
+
+    def __iter__(self):
+        return map(self.value, self.entity_nodes())
+
+
+def loads(data):
+    return Document(data).load()
+
+
+def load(path):
+    """The document stored at path, read through a memory map."""
+    return Document.open(path).load()
+
+
+def main(argv):
+    arg_parser = argparse.ArgumentParser(
+        prog="python3 -m Common.binformat",
+        description="Convert parser output between YAML and the binary format.",
+    )
+    arg_parser.add_argument("direction", choices=["to-binary", "to-yaml"])
+    arg_parser.add_argument("input")
+    arg_parser.add_argument("output", nargs="?", help="output path (default: stdout)")
+    opts = arg_parser.parse_args(argv)
+
+    if opts.direction == "to-binary":
+        with open(opts.input) as f:
+            data = dumps(yaml.load(f, Loader=SafeLoader))
+        if opts.output:
+            with open(opts.output, "wb") as f:
+                f.write(data)
+        else:
+            sys.stdout.buffer.write(data)
+    else:
+        d = load(opts.input)
+        if opts.output:
+            with open(opts.output, "w") as f:
+                emitter.write(d, f)
+        else:
+            emitter.write(d, sys.stdout)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
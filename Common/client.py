@@ -0,0 +1,195 @@
+"""
+Command-line client of the parser daemon (Common/server.py), a drop-in
+replacement for running a parser directly:
+
+    python3 Common/client.py header.h [clang args...]
+    python3 Common/client.py --parser tree_sitter header.h
+
+The document is written to stdout, or to -o. When no daemon listens on the
+socket, one is started in the background; it exits after --idle-timeout
+seconds without requests. Only the standard library is imported here, so a
+call costs the interpreter startup and one round trip.
+"""
+
+import argparse
+import base64
+import os
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+from Common.server import FORMATS, check_owner, default_socket_path, receive, send
+
+PARSERS = {
+    "clang": ROOT / "Clang" / "parser.py",
+    "tree_sitter": ROOT / "Tree_sitter" / "parser.py",
+}
+# Seconds to wait for a daemon started by the client to listen
+START_TIMEOUT = 30
+
+
+def connect(path):
+    """Connect to the daemon at path, refusing a socket of another user."""
+    check_owner(path)
+    client = socket.socket(socket.AF_UNIX)
+    try:
+        client.connect(path)
+    except OSError:
+        client.close()
+        raise
+    return client
+
+
+def start_daemon(parser, path, idle_timeout):
+    """Start a daemon for parser on path in the background and connect to it."""
+    daemon = subprocess.Popen(
+        [sys.executable, PARSERS[parser], "--serve", path]
+        + ["--idle-timeout", str(idle_timeout)],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    deadline = time.monotonic() + START_TIMEOUT
+    while True:
+        try:
+            return connect(path)
+        except PermissionError:
+            raise
+        except OSError:
+            # Another client may have won the race: its daemon is used then
+            if time.monotonic() > deadline or (
+                daemon.poll() is not None and not os.path.exists(path)
+            ):
+                raise
+        time.sleep(0.05)
+
+
+def request(client, message):
+    with client.makefile("rwb") as stream:
+        send(stream, message)
+        if (response := receive(stream)) is None:
+            raise ConnectionError("the daemon closed the connection")
+    return response
+
+
+def main(argv):
+    arg_parser = argparse.ArgumentParser(
+        description="Convert a header to THAPI YAML through a parser daemon.",
+        usage="%(prog)s [options] HEADER [CLANG_ARGS...]",
+    )
+    arg_parser.add_argument(
+        "--parser",
+        choices=PARSERS,
+        default="clang",
+        help="parser of the daemon (default: %(default)s)",
+    )
+    arg_parser.add_argument(
+        "--socket", help="daemon socket (default: one per parser and user)"
+    )
+    arg_parser.add_argument(
+        "--no-start",
+        action="store_true",
+        help="fail instead of starting a daemon when none is listening",
+    )
+    arg_parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=600,
+        help="seconds a daemon started by the client stays up without requests "
+        "(default: %(default)s)",
+    )
+    arg_parser.add_argument(
+        "--stop", action="store_true", help="shut the daemon down and exit"
+    )
+    arg_parser.add_argument("-o", "--output", help="output path (default: stdout)")
+    arg_parser.add_argument(
+        "--format",
+        choices=FORMATS,
+        default="yaml",
+        help="output format (default: %(default)s)",
+    )
+    arg_parser.add_argument(
+        "--main-file-only",
+        action="store_true",
+        help="only visit declarations of the header itself (Clang)",
+    )
+    arg_parser.add_argument(
+        "--allow-path",
+        action="append",
+        default=[],
+        help="file or directory whose declarations are visited too (Clang)",
+    )
+    arg_parser.add_argument(
+        "--macro-values",
+        action="store_true",
+        help="follow enumerator initializers into macros (Clang)",
+    )
+    arg_parser.add_argument("inputs", nargs=argparse.REMAINDER)
+    opts = arg_parser.parse_args(argv)
+    try:
+        path = opts.socket or default_socket_path(opts.parser)
+    except PermissionError as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    if opts.stop:
+        try:
+            with connect(path) as client:
+                request(client, {"op": "shutdown"})
+        except PermissionError as e:
+            print(e, file=sys.stderr)
+            return 1
+        except OSError:
+            pass
+        return 0
+    if not opts.inputs:
+        arg_parser.error("no header given")
+
+    header, clang_args = opts.inputs[0], opts.inputs[1:]
+    message = {
+        "header": header,
+        "cwd": os.getcwd(),
+        "args": clang_args,
+        "format": opts.format,
+        "macro_values": opts.macro_values,
+    }
+    if opts.main_file_only or opts.allow_path:
+        message["allow_paths"] = opts.allow_path
+    try:
+        try:
+            client = connect(path)
+        except PermissionError:
+            raise
+        except OSError:
+            if opts.no_start:
+                print(f"no daemon listening on {path}", file=sys.stderr)
+                return 1
+            client = start_daemon(opts.parser, path, opts.idle_timeout)
+    except PermissionError as e:
+        print(e, file=sys.stderr)
+        return 1
+    with client:
+        response = request(client, message)
+    if not response["ok"]:
+        print(f"{header}: {response['error']}", file=sys.stderr)
+        return 1
+    output = response["output"]
+    if response.get("encoding") == "base64":
+        output = base64.b64decode(output)
+    if opts.output:
+        with open(opts.output, "wb" if isinstance(output, bytes) else "w") as f:
+            f.write(output)
+    elif isinstance(output, bytes):
+        sys.stdout.buffer.write(output)
+    else:
+        sys.stdout.write(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,314 @@
+"""
+In-process conformance runner: compare a parser's entities with the reference
+output of the Ruby cast-to-yaml tool (emit_yaml.rb).
+
+    python3 -m Common.conformance --parser clang --jobs 4 unit_tests/*.h
+    python3 -m Common.conformance --parser tree_sitter
+
+The reference of a header is unit_tests/ruby_out/<stem>.out when it exists,
+otherwise the output of emit_yaml.rb, cached under the SHA-256 of the header
+and of emit_yaml.rb, so Ruby only runs for new or changed headers. Headers are
+converted in worker processes that load the parser once, and the entity trees
+are compared structurally: each differing entity is reported with the first
+path where it differs. The exit status is 1 when a case fails, so the runner
+doubles as a pre-commit check.
+"""
+
+import argparse
+import hashlib
+import importlib.util
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+import yaml
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+from Common import emitter
+from Common.disk_cache import file_digest, write_atomic
+from Common.ir import to_data
+
+UNIT_TESTS = ROOT / "unit_tests"
+RUBY_OUT = UNIT_TESTS / "ruby_out"
+EMIT_YAML = ROOT / "emit_yaml.rb"
+CACHE_ENV_VAR = "THAPI_REFERENCE_CACHE"
+# Longest repr of a value quoted in a mismatch report
+MAX_REPR = 60
+
+SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+def default_cache_dir():
+    if directory := os.environ.get(CACHE_ENV_VAR):
+        return Path(directory)
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_home) / "thapi" / "ruby_out"
+
+
+class ReferenceCache:
+    """Outputs of emit_yaml.rb, one file per header content."""
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.tool_digest = file_digest(EMIT_YAML)
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, header):
+        key = hashlib.sha256()
+        key.update(self.tool_digest.encode())
+        key.update(Path(header).read_bytes())
+        return self.directory / f"{key.hexdigest()}.yaml"
+
+    def get(self, header):
+        """The reference YAML of header, running Ruby when it is not cached yet."""
+        path = self.path(header)
+        try:
+            text = path.read_text()
+            self.hits += 1
+            return text
+        except FileNotFoundError:
+            pass
+        self.misses += 1
+        run = subprocess.run(
+            ["ruby", str(EMIT_YAML), str(header)], capture_output=True, text=True
+        )
+        if run.returncode != 0:
+            error = (run.stderr.strip().splitlines() or ["no output"])[0]
+            raise RuntimeError(f"emit_yaml.rb failed: {error}")
+        write_atomic(path, run.stdout.encode())
+        return run.stdout
+
+
+def reference_text(header, cache):
+    if (checked_in := RUBY_OUT / f"{Path(header).stem}.out").exists():
+        return checked_in.read_text()
+    return cache.get(header)
+
+
+def load_parser(parser):
+    if parser == "clang":
+        # Clang/parser.py imports its sibling modules as top-level ones
+        sys.path.insert(0, str(ROOT / "Clang"))
+        path = ROOT / "Clang" / "parser.py"
+    else:
+        path = ROOT / "Tree_sitter" / "parser.py"
+    spec = importlib.util.spec_from_file_location(f"{parser}_parser", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def convert_clang(module, header):
+    return module.parse_file(module.worker_index, str(header))
+
+
+def convert_tree_sitter(module, header):
+    source = Path(header).read_bytes()
+    tree = module.tree_sitter.Parser(module.C_LANGUAGE).parse(source)
+    return module.parse_translation_unit(module.ParseContext(source), tree.root_node)
+
+
+CONVERTERS = {"clang": convert_clang, "tree_sitter": convert_tree_sitter}
+
+# Parser module and converter loaded once by each worker process
+worker_module = None
+worker_convert = None
+
+
+def init_worker(parser):
+    global worker_module, worker_convert
+    worker_module = load_parser(parser)
+    worker_convert = CONVERTERS[parser]
+    if parser == "clang":
+        worker_module.init_worker(None, None)
+
+
+def short(value):
+    text = repr(value)
+    return text if len(text) <= MAX_REPR else text[: MAX_REPR - 3] + "..."
+
+
+def first_mismatch(expected, actual, path=""):
+    """Where actual first differs from expected, as "path: reason", or None.
+
+    Types must match exactly (1 is not True) and mappings must list their
+    keys in the same order, as the text of the YAML would.
+    """
+    if type(expected) is not type(actual):
+        return f"{path}: expected {short(expected)}, got {short(actual)}"
+    if isinstance(expected, dict):
+        for key, value in expected.items():
+            if key not in actual:
+                return f"{path}.{key}: missing, expected {short(value)}"
+            if mismatch := first_mismatch(value, actual[key], f"{path}.{key}"):
+                return mismatch
+        for key, value in actual.items():
+            if key not in expected:
+                return f"{path}.{key}: unexpected {short(value)}"
+        if list(expected) != list(actual):
+            return f"{path}: keys in order {list(actual)}, expected {list(expected)}"
+    elif isinstance(expected, list):
+        for i, (e, a) in enumerate(zip(expected, actual)):
+            if mismatch := first_mismatch(e, a, f"{path}[{i}]"):
+                return mismatch
+        if len(expected) != len(actual):
+            return f"{path}: {len(actual)} items, expected {len(expected)}"
+    elif expected != actual:
+        return f"{path}: expected {short(expected)}, got {short(actual)}"
+    return None
+
+
+def entity_name(entity):
+    """Name of an entity for reports: its first declarator, else its type."""
+    try:
+        return entity["declarators"][0]["name"]
+    except (KeyError, IndexError, TypeError):
+        pass
+    try:
+        return entity["type"]["name"]
+    except (KeyError, TypeError):
+        return "?"
+
+
+def compare_documents(expected, actual):
+    """Mismatch reports of two translation_unit documents, one per differing entity."""
+    if not isinstance(expected, dict) or "entities" not in expected:
+        return [f"reference is not a translation unit: {short(expected)}"]
+    if mismatch := first_mismatch(
+        {k: v for k, v in expected.items() if k != "entities"},
+        {k: v for k, v in actual.items() if k != "entities"},
+    ):
+        return [mismatch]
+    expected_entities = expected["entities"] or []
+    actual_entities = actual["entities"]
+    reports = []
+    for i, (e, a) in enumerate(zip(expected_entities, actual_entities)):
+        if mismatch := first_mismatch(e, a, f"entities[{i}]"):
+            reports.append(f"{mismatch} ({entity_name(e)})")
+    for i in range(len(actual_entities), len(expected_entities)):
+        reports.append(f"entities[{i}]: missing {entity_name(expected_entities[i])}")
+    for i in range(len(expected_entities), len(actual_entities)):
+        reports.append(f"entities[{i}]: unexpected {entity_name(actual_entities[i])}")
+    return reports
+
+
+def first_line_difference(expected, actual):
+    expected_lines, actual_lines = expected.splitlines(), actual.splitlines()
+    for i, (e, a) in enumerate(zip(expected_lines, actual_lines)):
+        if e != a:
+            break
+    else:
+        i = min(len(expected_lines), len(actual_lines))
+    e = expected_lines[i] if i < len(expected_lines) else "<end>"
+    a = actual_lines[i] if i < len(actual_lines) else "<end>"
+    return f"line {i + 1}: expected {short(e)}, got {short(a)}"
+
+
+def run_case(header, reference):
+    """Convert header and compare it with its reference YAML; return the reports.
+
+    The YAML text must match, as it did with diff; entity trees are only
+    compared to locate the differences.
+    """
+    try:
+        d = worker_convert(worker_module, header)
+        document = emitter.dump(d) + "\n"
+    except Exception as e:
+        return [f"{type(e).__name__}: {e}".splitlines()[0]]
+    if document == reference:
+        return []
+    expected = yaml.load(reference, Loader=SafeLoader)
+    actual = {"kind": d["kind"], "entities": to_data(d["entities"])}
+    reports = compare_documents(expected, actual)
+    return reports or [
+        f"same entities, different YAML text at {first_line_difference(reference, document)}"
+    ]
+
+
+def capture(f, *args):
+    """f(*args), or the exception it raised."""
+    try:
+        return f(*args)
+    except Exception as e:
+        return e
+
+
+def main(argv):
+    arg_parser = argparse.ArgumentParser(
+        prog="python3 -m Common.conformance",
+        description="Compare a parser's output with the emit_yaml.rb references.",
+    )
+    arg_parser.add_argument(
+        "--parser",
+        choices=CONVERTERS,
+        default="clang",
+        help="parser to check (default: %(default)s)",
+    )
+    arg_parser.add_argument(
+        "headers",
+        nargs="*",
+        type=Path,
+        help="headers to check (default: unit_tests/*.h)",
+    )
+    arg_parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="worker processes converting headers (default: %(default)s)",
+    )
+    arg_parser.add_argument(
+        "--reference-cache",
+        type=Path,
+        default=default_cache_dir(),
+        help="directory caching the emit_yaml.rb output of each header "
+        f"(default: ${CACHE_ENV_VAR} or %(default)s)",
+    )
+    opts = arg_parser.parse_args(argv)
+    headers = opts.headers or sorted(UNIT_TESTS.glob("*.h"))
+
+    start = time.perf_counter()
+    cache = ReferenceCache(opts.reference_cache)
+    references, failures = {}, {}
+    with ThreadPoolExecutor(opts.jobs) as pool:
+        for header, reference in zip(
+            headers,
+            pool.map(lambda h: capture(reference_text, h, cache), headers),
+        ):
+            if isinstance(reference, Exception):
+                failures[header] = [f"no reference: {reference}"]
+            else:
+                references[header] = reference
+
+    cases = [header for header in headers if header in references]
+    with ProcessPoolExecutor(
+        max(1, min(opts.jobs, len(cases))),
+        initializer=init_worker,
+        initargs=(opts.parser,),
+    ) as pool:
+        for header, reports in zip(
+            cases, pool.map(run_case, cases, [references[h] for h in cases])
+        ):
+            if reports:
+                failures[header] = reports
+
+    for header in headers:
+        if reports := failures.get(header):
+            print(f"FAIL {header}")
+            for report in reports:
+                print(f"  {report}")
+    print(
+        f"{len(headers) - len(failures)}/{len(headers)} cases passed in "
+        f"{time.perf_counter() - start:.2f} s ({cache.misses} emit_yaml.rb runs)"
+    )
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,102 @@
+"""
+Building blocks of the on-disk caches (libclang TUs, parser results).
+
+A cache is a directory holding one subdirectory per entry. Each entry has a
+manifest file whose mtime records the entry's last use. That lets the least
+recently used entries be evicted once the cache outgrows its cap. Source files
+an entry depends on are recorded with their mtime, size and content hash, and
+file_record/is_unchanged tell whether they still hold the same content.
+"""
+
+import hashlib
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+
+DEFAULT_MAX_BYTES = 1 << 30  # 1 GiB
+
+
+def file_digest(path):
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+def file_record(path):
+    st = os.stat(path)
+    return {
+        "path": path,
+        "mtime_ns": st.st_mtime_ns,
+        "size": st.st_size,
+        "sha256": file_digest(path),
+    }
+
+
+def is_unchanged(dep):
+    """Cheap stat check first; the content hash settles touched-but-identical files."""
+    try:
+        st = os.stat(dep["path"])
+    except OSError:
+        return False
+    if st.st_size != dep["size"]:
+        return False
+    if st.st_mtime_ns == dep["mtime_ns"]:
+        return True
+    return file_digest(dep["path"]) == dep["sha256"]
+
+
+def write_atomic(path, data):
+    """Write bytes to path through a temporary file, so readers never see a partial file."""
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+class CacheDirectory:
+    """A directory of cache entries, evicted least recently used first."""
+
+    manifest = "deps.json"
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def entries(self):
+        """(last use, size in bytes, path) of every entry, least recently used first."""
+        found = []
+        for entry in self.directory.iterdir():
+            try:
+                last_use = (entry / self.manifest).stat().st_mtime
+                size = sum(f.stat().st_size for f in entry.iterdir())
+            except OSError:
+                continue
+            found.append((last_use, size, entry))
+        return sorted(found)
+
+    def evict(self):
+        self.prune(self.max_bytes)
+
+    def prune(self, max_bytes=None, max_age=None):
+        """Remove entries unused for max_age seconds, then the oldest ones above max_bytes.
+
+        Return the removed entries as (last use, size, path).
+        """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        removed = []
+        for last_use, size, entry in entries:
+            too_old = max_age is not None and time.time() - last_use > max_age
+            too_big = max_bytes is not None and total > max_bytes
+            if not (too_old or too_big):
+                continue
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+            removed.append((last_use, size, entry))
+        return removed
+
+    def clear(self):
+        return self.prune(max_bytes=0)
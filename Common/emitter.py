@@ -0,0 +1,125 @@
+"""
+YAML emission shared by both parsers.
+
+The format is fixed: explicit document start, block style only, keys in
+insertion order and no anchors/aliases for repeated data. The libyaml-backed
+CDumper is used when PyYAML was built with it; it produces the same bytes as
+the pure-Python Dumper, only faster. IR nodes (Common/ir.py) are written as
+the mappings they stand for.
+
+get_dumper(aliases=True) gives dumpers that write each interned leaf type
+(Common/ir.LeafType) in full the first time and as an alias after that, which
+shrinks documents with many repeated parameter types. Anchors are scoped to one
+YAML document, so such dumpers need the whole document at once.
+"""
+
+import yaml
+
+from Common.ir import LeafType, Node
+
+DUMP_OPTIONS = {"sort_keys": False, "default_flow_style": False}
+
+
+class Dumper(yaml.Dumper):
+    aliases = False
+
+    def ignore_aliases(self, data):
+        return True
+
+
+class AliasDumper(Dumper):
+    aliases = True
+
+    def ignore_aliases(self, data):
+        return not isinstance(data, LeafType)
+
+
+if yaml.__with_libyaml__:
+
+    class CDumper(yaml.CDumper):
+        aliases = False
+
+        def ignore_aliases(self, data):
+            return True
+
+    class CAliasDumper(CDumper):
+        aliases = True
+
+        def ignore_aliases(self, data):
+            return not isinstance(data, LeafType)
+
+else:
+    CDumper = CAliasDumper = None
+
+
+def represent_node(dumper, node):
+    return dumper.represent_mapping("tag:yaml.org,2002:map", node.items())
+
+
+for _dumper in filter(None, [Dumper, CDumper]):
+    _dumper.add_multi_representer(Node, represent_node)
+
+BACKENDS = {"auto": CDumper or Dumper, "c": CDumper, "python": Dumper}
+ALIAS_BACKENDS = {
+    "auto": CAliasDumper or AliasDumper,
+    "c": CAliasDumper,
+    "python": AliasDumper,
+}
+
+
+def get_dumper(backend="auto", aliases=False):
+    """Dumper class of backend; with aliases, repeated leaf types are written as aliases."""
+    if (dumper := (ALIAS_BACKENDS if aliases else BACKENDS)[backend]) is None:
+        raise ValueError(f"YAML backend '{backend}' is not available")
+    return dumper
+
+
+def dump(d, dumper=BACKENDS["auto"]):
+    return yaml.dump(d, Dumper=dumper, explicit_start=True, **DUMP_OPTIONS).strip()
+
+
+def write(d, stream, dumper=BACKENDS["auto"]):
+    stream.write(dump(d, dumper) + "\n")
+
+
+def dump_entity(entity, dumper=BACKENDS["auto"]):
+    """The YAML text of one entity as an item of the "entities" sequence."""
+    # A top-level sequence is laid out exactly like the indentless one under "entities"
+    return yaml.dump([entity], Dumper=dumper, **DUMP_OPTIONS)
+
+
+def dump_entities(entities, dumper=BACKENDS["auto"]):
+    """The YAML text of consecutive items of the "entities" sequence, "" for none."""
+    if not entities:
+        return ""
+    return yaml.dump(entities, Dumper=dumper, **DUMP_OPTIONS)
+
+
+def write_entity_texts(texts, stream):
+    """Write a translation_unit document from the dump_entity() text of each entity.
+
+    A text may also hold several entities, as given by dump_entities().
+    """
+    stream.write("---\nkind: translation_unit\nentities:")
+    empty = True
+    for text in texts:
+        if not text:
+            continue
+        if empty:
+            stream.write("\n")
+            empty = False
+        stream.write(text)
+    if empty:
+        stream.write(" []\n")
+
+
+def write_translation_unit(entities, stream, dumper=BACKENDS["auto"]):
+    """Write a translation_unit document one entity at a time, as entities are produced.
+
+    The output is byte-identical to write({"kind": "translation_unit", "entities": [...]}).
+    """
+    if dumper.aliases:
+        # Anchors are shared by the whole document: it is dumped at once
+        write({"kind": "translation_unit", "entities": list(entities)}, stream, dumper)
+        return
+    write_entity_texts((dump_entity(entity, dumper) for entity in entities), stream)
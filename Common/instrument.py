@@ -0,0 +1,217 @@
+"""
+Opt-in instrumentation of the parsers: call counts and times of their hot
+functions, libclang calls, and the wall time and memory growth of each phase.
+
+Instrumentation is enabled with --profile PATH on either parser, or with the
+THAPI_PROFILE environment variable set to a path:
+
+    python3 Clang/parser.py --profile prof.json header.h
+    THAPI_PROFILE=prof.json python3 Tree_sitter/parser.py header.h
+    python3 -m pstats prof.pstats
+
+The JSON report goes to PATH and a pstats-compatible dump of the instrumented
+functions next to it, with a .pstats suffix. Nothing is wrapped unless
+enable() is called: the hot functions are rebound in the parser's module
+globals only then, and phase() costs a global lookup when disabled.
+"""
+
+import json
+import marshal
+import os
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from inspect import unwrap
+from pathlib import Path
+
+ENV_VAR = "THAPI_PROFILE"
+
+# The Recorder of this process, None while instrumentation is disabled
+recorder = None
+
+NO_PHASE = nullcontext()
+
+
+class CallCounter:
+    """Stand-in for clang.cindex.conf.lib counting every libclang function call."""
+
+    def __init__(self, lib):
+        self._lib = lib
+        self.counts = Counter()
+
+    def __getattr__(self, name):
+        fn = getattr(self._lib, name)
+        counts = self.counts
+
+        def counted(*args):
+            counts[name] += 1
+            return fn(*args)
+
+        setattr(self, name, counted)
+        return counted
+
+
+def function_key(func):
+    """pstats key of a function: (file name, first line, name)."""
+    code = unwrap(func).__code__
+    return (code.co_filename, code.co_firstlineno, code.co_name)
+
+
+class Recorder:
+    """Call statistics of the wrapped functions and totals of each phase.
+
+    Functions are timed like cProfile does: own time excludes the wrapped
+    functions they call, cumulative time counts only the outermost call of a
+    recursion.
+    """
+
+    def __init__(self):
+        self.keys = {}  # function name -> pstats key
+        # function name -> [primitive calls, calls, own ns, cumulative ns]
+        self.functions = {}
+        # (function name, caller name) -> [primitive calls, calls, own ns, cumulative ns]
+        self.edges = {}
+        self.phases = {}  # phase name -> [calls, wall ns, net blocks]
+        self.stack = []  # [function name, ns spent in wrapped callees]
+        self.active = Counter()  # function name -> calls in progress
+        self.lib = None  # CallCounter standing for the libclang library
+
+    def wrap(self, func, name):
+        self.keys[name] = function_key(func)
+        stats = self.functions.setdefault(name, [0, 0, 0, 0])
+        stack, active, edges = self.stack, self.active, self.edges
+        clock = time.perf_counter_ns
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            caller = stack[-1][0] if stack else None
+            primitive = not active[name]
+            frame = [name, 0]
+            stack.append(frame)
+            active[name] += 1
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = clock() - start
+                active[name] -= 1
+                stack.pop()
+                if stack:
+                    stack[-1][1] += elapsed
+                own = elapsed - frame[1]
+                for s in (stats, edges.setdefault((name, caller), [0, 0, 0, 0])):
+                    s[0] += primitive
+                    s[1] += 1
+                    s[2] += own
+                    s[3] += elapsed if primitive else 0
+
+        return wrapper
+
+    def instrument(self, namespace, names):
+        """Replace each named function of a module's globals by a wrapper timing it."""
+        for name in names:
+            namespace[name] = self.wrap(namespace[name], name)
+
+    def count_libclang(self):
+        import clang.cindex
+
+        self.lib = clang.cindex.conf.lib = CallCounter(clang.cindex.conf.lib)
+
+    @contextmanager
+    def phase(self, name):
+        """Time a phase and record its net change in live memory blocks.
+
+        The change is that of sys.getallocatedblocks(): blocks allocated minus
+        blocks freed during the phase, not a count of allocations, so a phase
+        building short-lived objects may report few blocks.
+        """
+        totals = self.phases.setdefault(name, [0, 0, 0])
+        blocks = sys.getallocatedblocks()
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            totals[0] += 1
+            totals[1] += time.perf_counter_ns() - start
+            totals[2] += sys.getallocatedblocks() - blocks
+
+    def report(self) -> dict:
+        functions = sorted(self.functions.items(), key=lambda item: -item[1][3])
+        report = {
+            "phases": {
+                name: {
+                    "calls": calls,
+                    "wall_s": ns / 1e9,
+                    "net_blocks": blocks,
+                }
+                for name, (calls, ns, blocks) in self.phases.items()
+            },
+            "functions": {
+                name: {
+                    "calls": calls,
+                    "primitive_calls": primitive,
+                    "own_s": own / 1e9,
+                    "cumulative_s": cumulative / 1e9,
+                }
+                for name, (primitive, calls, own, cumulative) in functions
+                if calls
+            },
+        }
+        if self.lib is not None:
+            report["libclang_calls"] = {
+                "total": self.lib.counts.total(),
+                "by_function": dict(self.lib.counts.most_common()),
+            }
+        return report
+
+    def pstats(self) -> dict:
+        """The statistics of the wrapped functions in the format pstats.Stats loads."""
+        stats = {}
+        for name, (primitive, calls, own, cumulative) in self.functions.items():
+            if calls:
+                stats[self.keys[name]] = (
+                    primitive,
+                    calls,
+                    own / 1e9,
+                    cumulative / 1e9,
+                    {},
+                )
+        for (name, caller), (primitive, calls, own, cumulative) in self.edges.items():
+            if caller is not None:
+                # Caller entries list the call count before the primitive one
+                stats[self.keys[name]][4][self.keys[caller]] = (
+                    calls,
+                    primitive,
+                    own / 1e9,
+                    cumulative / 1e9,
+                )
+        return stats
+
+    def write(self, path):
+        """Write the JSON report to path and the pstats dump next to it."""
+        path = Path(path)
+        path.write_text(json.dumps(self.report(), indent=1) + "\n")
+        with open(path.with_suffix(".pstats"), "wb") as f:
+            marshal.dump(self.pstats(), f)
+
+
+def output_path(option=None):
+    """Where the report goes: the --profile option, else THAPI_PROFILE, else None."""
+    return option or os.environ.get(ENV_VAR) or None
+
+
+def enable(namespace, names, libclang=False) -> Recorder:
+    """Start recording: wrap the named functions of namespace (a module's globals)."""
+    global recorder
+    recorder = Recorder()
+    recorder.instrument(namespace, names)
+    if libclang:
+        recorder.count_libclang()
+    return recorder
+
+
+def phase(name):
+    """Context manager timing a phase, doing nothing when instrumentation is disabled."""
+    return NO_PHASE if recorder is None else recorder.phase(name)
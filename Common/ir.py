@@ -0,0 +1,221 @@
+"""
+Intermediate representation built by both parsers and written by the emitter.
+
+Every node is a small __slots__ object holding the keys of one THAPI YAML
+mapping. Its fields are listed in output order, and a field set to None is
+left out of the mapping. The emitter represents nodes directly, so no dict is
+built for them; to_dict() gives the plain data for other consumers.
+
+Nodes reachable from several places (memoized declarations and types) are
+shared, so they must not be modified once built. Leaf types (builtins,
+custom_type and tags referred to by name) are interned: leaf_type() returns
+one immutable LeafType per distinct leaf, so equal leaves are the same object
+and compare by identity. Identifier strings are interned with sys.intern().
+"""
+
+from itertools import zip_longest
+from sys import intern
+
+
+class Node:
+    __slots__ = ()
+    kind = None
+    fields = ()
+
+    def items(self):
+        """(key, value) pairs of the YAML mapping, in output order."""
+        yield "kind", self.kind
+        for name in self.fields:
+            if (value := getattr(self, name)) is not None:
+                yield name, value
+
+    def to_dict(self):
+        return {key: to_data(value) for key, value in self.items()}
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        return type(self) is type(other) and list(self.items()) == list(other.items())
+
+    __hash__ = None
+
+    def __repr__(self):
+        fields = ", ".join(f"{k}={v!r}" for k, v in self.items() if k != "kind")
+        return f"{type(self).__name__}({fields})"
+
+
+def intern_name(name):
+    return name if name is None else intern(name)
+
+
+def to_data(value):
+    """Plain dicts and lists for a node, or a list of nodes."""
+    if isinstance(value, Node):
+        return value.to_dict()
+    if isinstance(value, list):
+        return [to_data(v) for v in value]
+    return value
+
+
+class Declaration(Node):
+    __slots__ = ("storage", "type", "declarators")
+    kind = "declaration"
+    fields = __slots__
+
+    def __init__(self, type, declarators=None, storage=None):
+        self.storage = storage
+        self.type = type
+        self.declarators = declarators
+
+
+class Declarator(Node):
+    __slots__ = ("indirect_type", "name")
+    kind = "declarator"
+    fields = __slots__
+
+    def __init__(self, name, indirect_type=None):
+        self.indirect_type = indirect_type
+        self.name = intern_name(name)
+
+
+class Type(Node):
+    """Any type but pointers: builtin, custom_type, struct, union, enum, array, function."""
+
+    __slots__ = (
+        "kind",
+        "name",
+        "longness",
+        "signed",
+        "unsigned",
+        "members",
+        "type",
+        "length",
+        "params",
+    )
+    fields = __slots__[1:]
+
+    def __init__(
+        self,
+        kind,
+        name=None,
+        longness=None,
+        signed=None,
+        unsigned=None,
+        members=None,
+        type=None,
+        length=None,
+        params=None,
+    ):
+        self.kind = kind
+        self.name = intern_name(name)
+        self.longness = longness
+        self.signed = signed
+        self.unsigned = unsigned
+        self.members = members
+        self.type = type
+        self.length = length
+        self.params = params
+
+
+class LeafType(Type):
+    """A Type without members, element or parameters, built by leaf_type() only.
+
+    Instances are canonical and immutable: equality is identity, so they can be
+    hashed and compared in constant time.
+    """
+
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __eq__(self, other):
+        if isinstance(other, LeafType):
+            return self is other
+        # A plain Type equal to a leaf, as built by other consumers of the IR
+        return isinstance(other, Type) and list(self.items()) == list(other.items())
+
+    __hash__ = object.__hash__
+
+    def __reduce__(self):
+        # Unpickled leaves (result cache, worker processes) are interned again
+        return leaf_type, (
+            self.kind,
+            self.name,
+            self.longness,
+            self.signed,
+            self.unsigned,
+        )
+
+
+# (kind, name, longness, signed, unsigned) -> its LeafType
+leaf_types = {}
+
+
+def leaf_type(kind, name=None, longness=None, signed=None, unsigned=None):
+    """The canonical LeafType of a builtin, custom_type or tag referred to by name."""
+    key = (kind, name, longness, signed, unsigned)
+    try:
+        return leaf_types[key]
+    except KeyError:
+        pass
+    leaf = object.__new__(LeafType)
+    values = (kind, intern_name(name), longness, signed, unsigned)
+    for field, value in zip_longest(Type.__slots__, values):
+        object.__setattr__(leaf, field, value)
+    # setdefault: a thread building the same leaf concurrently gets the first one
+    return leaf_types.setdefault(key, leaf)
+
+
+class Pointer(Node):
+    __slots__ = ("type",)
+    kind = "pointer"
+    fields = __slots__
+
+    def __init__(self, type=None):
+        self.type = type
+
+
+class Parameter(Node):
+    __slots__ = ("type", "name")
+    kind = "parameter"
+    fields = __slots__
+
+    def __init__(self, type, name):
+        self.type = type
+        self.name = intern_name(name)
+
+
+class Enumerator(Node):
+    __slots__ = ("name", "val")
+    kind = "enumerator"
+    fields = __slots__
+
+    def __init__(self, name, val):
+        self.name = intern_name(name)
+        self.val = val
+
+
+class IntLiteral(Node):
+    __slots__ = ("format", "val")
+    kind = "int_literal"
+    fields = __slots__
+
+    def __init__(self, val, format=None):
+        self.format = format
+        self.val = val
+
+
+class Negative(Node):
+    __slots__ = ("expr",)
+    kind = "negative"
+    fields = __slots__
+
+    def __init__(self, expr):
+        self.expr = expr
+
+
+def int_value(v, hex=False):
+    """IntLiteral for v, wrapped in Negative when v < 0."""
+    literal = IntLiteral(abs(v), ":hex" if hex else None)
+    return Negative(literal) if v < 0 else literal
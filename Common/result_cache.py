@@ -0,0 +1,197 @@
+"""
+On-disk cache of parser results, shared by both parsers.
+
+An entry holds the entity list produced for one header and is keyed by a hash
+of the parser name, the header path and content, the working directory, the
+parser settings (compiler arguments, options) and the parser version (the
+digest of its source files and the versions of the libraries it relies on):
+
+    <cache dir>/<key>/entities.pickle  the pickled entity list
+    <cache dir>/<key>/document.yaml    the YAML document written for it, if any
+    <cache dir>/<key>/manifest.json    header, parser, settings, entity count and
+                                       the include set, each file with its mtime,
+                                       size and content hash
+
+A hit requires every file of the include set to be unchanged, and skips
+parsing entirely; with the stored document, emitting the YAML is skipped too.
+Entries are evicted least recently used first once the cache outgrows its cap.
+The cache can be inspected and pruned from the command line:
+
+    python3 -m Common.result_cache CACHE_DIR
+    python3 -m Common.result_cache CACHE_DIR --max-size 64 --max-age 30
+    python3 -m Common.result_cache CACHE_DIR --clear
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import sys
+import time
+
+from Common.disk_cache import (
+    DEFAULT_MAX_BYTES,
+    CacheDirectory,
+    file_digest,
+    file_record,
+    is_unchanged,
+    write_atomic,
+)
+
+
+def parser_version(sources, **libraries):
+    """Version string of a parser: digests of its source files and library versions."""
+    digests = {os.path.basename(path): file_digest(path) for path in sources}
+    return json.dumps({"sources": digests, "libraries": libraries}, sort_keys=True)
+
+
+class ResultCache(CacheDirectory):
+    manifest = "manifest.json"
+
+    def __init__(self, directory, parser, version, max_bytes=DEFAULT_MAX_BYTES):
+        super().__init__(directory, max_bytes)
+        self.parser = parser
+        self.version = version
+
+    def entry_key(self, path, settings):
+        key = json.dumps(
+            [
+                self.parser,
+                os.path.abspath(path),
+                file_digest(path),
+                # Relative paths in the settings' args depend on the working directory
+                os.getcwd(),
+                settings,
+                self.version,
+            ]
+        )
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def _valid_entry(self, path, settings):
+        """Directory of the entry for path if no file of its include set changed."""
+        entry = self.directory / self.entry_key(path, settings)
+        manifest = entry / self.manifest
+        try:
+            deps = json.loads(manifest.read_text())["deps"]
+        except (OSError, ValueError, KeyError):
+            return None
+        if not all(is_unchanged(dep) for dep in deps):
+            return None
+        manifest.touch()
+        return entry
+
+    def get(self, path, settings=None):
+        """Return the stored entity list of path, or None when missing or out of date.
+
+        settings must be JSON serializable and hold everything, besides the
+        header and its includes, the entities depend on.
+        """
+        entities = None
+        if (entry := self._valid_entry(path, settings)) is not None:
+            try:
+                with open(entry / "entities.pickle", "rb") as f:
+                    entities = pickle.load(f)
+            except (OSError, pickle.UnpicklingError):
+                pass
+        if entities is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entities
+
+    def get_document(self, path, settings=None):
+        """Return the YAML document stored for path, or None; failures are not misses."""
+        if (entry := self._valid_entry(path, settings)) is None:
+            return None
+        try:
+            document = (entry / "document.yaml").read_text()
+        except OSError:
+            return None
+        self.hits += 1
+        return document
+
+    def put(self, path, settings, entities, includes=()):
+        """Store entities for path; includes are the files it was built from besides path."""
+        entry = self.directory / self.entry_key(path, settings)
+        entry.mkdir(exist_ok=True)
+        # The document was dumped from the entities replaced here
+        (entry / "document.yaml").unlink(missing_ok=True)
+        files = sorted({os.path.abspath(path), *map(os.path.abspath, includes)})
+        write_atomic(
+            entry / "entities.pickle",
+            pickle.dumps(entities, protocol=pickle.HIGHEST_PROTOCOL),
+        )
+        manifest = {
+            "header": os.path.abspath(path),
+            "parser": self.parser,
+            "settings": settings,
+            "entities": len(entities),
+            "deps": [file_record(f) for f in files],
+        }
+        write_atomic(entry / self.manifest, json.dumps(manifest).encode())
+        self.evict()
+
+    def put_document(self, path, settings, document):
+        """Attach the YAML document written for path to its (up to date) entry."""
+        if (entry := self._valid_entry(path, settings)) is not None:
+            write_atomic(entry / "document.yaml", document.encode())
+
+
+def describe(cache):
+    """Yield (last use, size, manifest dict) of every entry, least recently used first."""
+    for last_use, size, entry in cache.entries():
+        try:
+            manifest = json.loads((entry / cache.manifest).read_text())
+        except (OSError, ValueError):
+            manifest = {}
+        yield last_use, size, manifest
+
+
+def main(argv):
+    arg_parser = argparse.ArgumentParser(
+        prog="python3 -m Common.result_cache",
+        description="Inspect and prune a parser result cache.",
+    )
+    arg_parser.add_argument("directory", help="cache directory")
+    arg_parser.add_argument(
+        "--max-size",
+        type=int,
+        help="evict least recently used entries above this size (MiB)",
+    )
+    arg_parser.add_argument(
+        "--max-age", type=float, help="remove entries unused for this many days"
+    )
+    arg_parser.add_argument("--clear", action="store_true", help="remove every entry")
+    opts = arg_parser.parse_args(argv)
+    if not os.path.isdir(opts.directory):
+        arg_parser.error(f"no cache at {opts.directory}")
+
+    cache = CacheDirectory(opts.directory)
+    cache.manifest = ResultCache.manifest
+    if opts.clear or opts.max_size is not None or opts.max_age is not None:
+        if opts.clear:
+            removed = cache.clear()
+        else:
+            removed = cache.prune(
+                None if opts.max_size is None else opts.max_size << 20,
+                None if opts.max_age is None else opts.max_age * 86400,
+            )
+        freed = sum(size for _, size, _ in removed)
+        print(f"removed {len(removed)} entries, {freed / 1024:.1f} KiB")
+        return 0
+
+    total = 0
+    for last_use, size, manifest in describe(cache):
+        total += size
+        used = time.strftime("%Y-%m-%d %H:%M", time.localtime(last_use))
+        print(
+            f"{used}  {size / 1024:9.1f} KiB  {manifest.get('parser', '?'):12} "
+            f"{manifest.get('entities', '?'):>6} entities  {manifest.get('header', '?')}"
+        )
+    print(f"total {total / 1024:.1f} KiB")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
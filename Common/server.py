@@ -0,0 +1,259 @@
+"""
+Long-lived parser daemon on a Unix socket, shared by both parsers.
+
+Each parser starts it with --serve [SOCKET]. Requests and responses are JSON
+objects, one per line, and a connection may send any number of requests,
+answered in order:
+
+    {"header": "a.h", "cwd": "/src", "args": ["-Ifoo"], "format": "yaml"}
+    {"ok": true, "output": "---\\nkind: translation_unit\\n..."}
+    {"ok": true, "output": "VEhBUElCSU4B...", "encoding": "base64"}
+    {"ok": false, "error": "TranslationUnitLoadError: Error parsing translation unit."}
+
+Besides header, args (compiler arguments), cwd (the directory relative paths
+are resolved from) and format ("yaml", or "binary" for the encoding of
+Common/binformat.py, sent as base64), a request may carry the options of the
+parser (see its convert_request()). {"op": "ping"} describes the daemon and
+{"op": "shutdown"} stops it.
+
+Headers are converted by a bounded pool of worker processes: a worker keeps
+its imports, libclang Index and in-memory caches between requests, so repeated
+headers skip interpreter startup and, while unchanged, parsing. Connections
+are served by threads that only wait on the pool.
+
+Common/client.py is the command-line client, and starts a daemon when none
+is listening.
+"""
+
+import base64
+import errno
+import json
+import os
+import socket
+import socketserver
+import stat
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+
+FORMATS = ("yaml", "binary")
+SOCKET_ENV_VAR = "THAPI_PARSER_SOCKET_DIR"
+
+
+def default_socket_path(parser):
+    """Socket of the daemon of parser ("clang" or "tree_sitter") for this user.
+
+    It lives in a thapi-<uid> directory only this user can enter, created as
+    needed, so other users can neither take the name first nor connect.
+    """
+    base = (
+        os.environ.get(SOCKET_ENV_VAR)
+        or os.environ.get("XDG_RUNTIME_DIR")
+        or tempfile.gettempdir()
+    )
+    directory = os.path.join(base, f"thapi-{os.getuid()}")
+    private_directory(directory)
+    return os.path.join(directory, f"{parser}.sock")
+
+
+def private_directory(directory):
+    """Create directory with mode 0700, or check that the existing one is ours and private."""
+    try:
+        os.mkdir(directory, 0o700)
+    except FileExistsError:
+        pass
+    st = os.lstat(directory)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise PermissionError(f"{directory} is not a private directory of this user")
+
+
+def check_owner(path):
+    """Refuse a socket at path that another user created."""
+    if (uid := os.stat(path).st_uid) != os.getuid():
+        raise PermissionError(f"{path} belongs to another user (uid {uid})")
+
+
+def send(stream, message):
+    stream.write(json.dumps(message).encode() + b"\n")
+    stream.flush()
+
+
+def receive(stream):
+    """Next message of stream, or None once it is closed."""
+    line = stream.readline()
+    return json.loads(line) if line else None
+
+
+def call_handler(handler, request):
+    """Run handler on a request in a worker, from the client's working directory."""
+    if cwd := request.get("cwd"):
+        os.chdir(cwd)
+    return handler(request)
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while (request := self.read_request()) is not None:
+            self.server.begin()
+            try:
+                response = self.server.respond(request)
+            finally:
+                self.server.end()
+            try:
+                send(self.wfile, response)
+            except OSError:  # the client went away
+                return
+
+    def read_request(self):
+        try:
+            return receive(self.rfile)
+        except ValueError as e:
+            send(self.wfile, {"ok": False, "error": f"invalid request: {e}"})
+            return None
+
+
+class ParserServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Answer the requests of every connection with a pool of warm worker processes.
+
+    handler(request) -> str runs in the workers and must be a module-level
+    function; initializer(*initargs) sets up the state they keep.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path, parser, handler, initializer, initargs=(), jobs=1):
+        super().__init__(path, RequestHandler, bind_and_activate=False)
+        bind_socket(self, path)
+        self.parser = parser
+        self.handler = handler
+        self.jobs = jobs
+        self.pool_args = {
+            "max_workers": jobs,
+            "mp_context": get_context("spawn"),
+            "initializer": initializer,
+            "initargs": initargs,
+        }
+        self.pool = ProcessPoolExecutor(**self.pool_args)
+        self.lock = threading.Lock()
+        self.active = 0
+        self.last_activity = time.monotonic()
+        self.served = 0
+
+    def server_bind(self):
+        # The socket is created private: nobody else can connect before a chmod
+        umask = os.umask(0o077)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(umask)
+
+    def begin(self):
+        with self.lock:
+            self.active += 1
+
+    def end(self):
+        with self.lock:
+            self.active -= 1
+            self.served += 1
+            self.last_activity = time.monotonic()
+
+    def idle_for(self):
+        with self.lock:
+            return 0 if self.active else time.monotonic() - self.last_activity
+
+    def respond(self, request):
+        if not isinstance(request, dict):
+            return {"ok": False, "error": "invalid request: not an object"}
+        match request.get("op", "convert"):
+            case "convert":
+                return self.convert(request)
+            case "ping":
+                return {
+                    "ok": True,
+                    "parser": self.parser,
+                    "pid": os.getpid(),
+                    "jobs": self.jobs,
+                    "served": self.served,
+                }
+            case "shutdown":
+                threading.Thread(target=self.shutdown).start()
+                return {"ok": True}
+            case op:
+                return {"ok": False, "error": f"unknown op: {op}"}
+
+    def convert(self, request):
+        if "header" not in request:
+            return {"ok": False, "error": "invalid request: no header"}
+        if (format := request.get("format", "yaml")) not in FORMATS:
+            return {"ok": False, "error": f"unsupported format: {format}"}
+        pool = self.pool
+        try:
+            output = pool.submit(call_handler, self.handler, request).result()
+        except BrokenProcessPool:
+            # A worker died (libclang can abort on odd input): start a fresh pool
+            with self.lock:
+                if self.pool is pool:
+                    self.pool = ProcessPoolExecutor(**self.pool_args)
+            return {"ok": False, "error": "worker process died"}
+        except Exception as e:
+            return {"ok": False, "error": f"{type(e).__name__}: {e}"}
+        if isinstance(output, bytes):
+            output = base64.b64encode(output).decode()
+            return {"ok": True, "output": output, "encoding": "base64"}
+        return {"ok": True, "output": output}
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(cancel_futures=True)
+        try:
+            os.unlink(self.server_address)
+        except OSError:
+            pass
+
+
+def bind_socket(server, path):
+    """Bind and listen on path, replacing a stale socket but not a live daemon."""
+    try:
+        server.server_bind()
+    except OSError as e:
+        if e.errno != errno.EADDRINUSE:
+            raise
+        probe = socket.socket(socket.AF_UNIX)
+        try:
+            probe.connect(path)
+        except OSError:
+            os.unlink(path)
+        else:
+            server.socket.close()
+            raise RuntimeError(f"a daemon is already listening on {path}")
+        finally:
+            probe.close()
+        server.server_bind()
+    server.server_activate()
+
+
+def serve(path, parser, handler, initializer, initargs=(), jobs=1, idle_timeout=None):
+    """Serve parse requests on the Unix socket at path until shut down.
+
+    With idle_timeout, the daemon exits after that many seconds without a request.
+    """
+    server = ParserServer(path, parser, handler, initializer, initargs, jobs)
+    if idle_timeout:
+
+        def watch_idle():
+            while (idle := server.idle_for()) < idle_timeout:
+                time.sleep(min(idle_timeout - idle, 1.0))
+            server.shutdown()
+
+        threading.Thread(target=watch_idle, daemon=True).start()
+    print(f"{parser} parser listening on {path}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
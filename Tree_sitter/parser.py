@@ -2,336 +2,1347 @@
 RUN INSTRUCTIONS: $python3 parser.py <PATH TO HEADER FILE>
 """
 
+import argparse
+import importlib.metadata
+import io
+import os
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from itertools import repeat
 import tree_sitter_c
 import tree_sitter
-import yaml
 import sys
+import operator
 import re
+from functools import cache
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from Common import binformat, emitter, instrument, server
+from Common.disk_cache import DEFAULT_MAX_BYTES
+from Common.ir import (
+    Declaration,
+    Declarator,
+    Enumerator,
+    Parameter,
+    Pointer,
+    Type,
+    int_value,
+    leaf_type,
+)
+from Common.result_cache import ResultCache, parser_version
+
+C_LANGUAGE = tree_sitter.Language(tree_sitter_c.language())
+
+# Field ids of the grammar: child_by_field_id() skips the name lookup
+ALTERNATIVE_FIELD = C_LANGUAGE.field_id_for_name("alternative")
+ARGUMENT_FIELD = C_LANGUAGE.field_id_for_name("argument")
+BODY_FIELD = C_LANGUAGE.field_id_for_name("body")
+CONDITION_FIELD = C_LANGUAGE.field_id_for_name("condition")
+CONSEQUENCE_FIELD = C_LANGUAGE.field_id_for_name("consequence")
+DECLARATOR_FIELD = C_LANGUAGE.field_id_for_name("declarator")
+LEFT_FIELD = C_LANGUAGE.field_id_for_name("left")
+NAME_FIELD = C_LANGUAGE.field_id_for_name("name")
+OPERATOR_FIELD = C_LANGUAGE.field_id_for_name("operator")
+PARAMETERS_FIELD = C_LANGUAGE.field_id_for_name("parameters")
+RIGHT_FIELD = C_LANGUAGE.field_id_for_name("right")
+SIZE_FIELD = C_LANGUAGE.field_id_for_name("size")
+TYPE_FIELD = C_LANGUAGE.field_id_for_name("type")
+VALUE_FIELD = C_LANGUAGE.field_id_for_name("value")
+
+# Struct, union and enum definitions at any depth, records nested in others included
+TAG_DEFINITION_QUERY = tree_sitter.Query(
+    C_LANGUAGE,
+    """
+    [
+      (struct_specifier body: (_))
+      (union_specifier body: (_))
+      (enum_specifier body: (_))
+    ] @definition
+    """,
+)
 
 
 ###########################################################################
-###--------------------------Global_Variables---------------------------###
+###----------------------------Parse_Context----------------------------###
 ###########################################################################
-header_source = ""  # Source code string variable
+class ParseContext:
+    """State of the conversion of one header, passed to every parse_* function.
+
+    The source is held as a memoryview, so node text is looked up without
+    copying. Each distinct identifier or type name is decoded once and interned,
+    and every later occurrence reuses that string. The tag index (definitions
+    and typedef names of structs, unions and enums) is filled by
+    build_tag_index() before any entity is converted. Contexts share nothing, so
+    headers can be converted one after another or in threads.
+    """
+
+    __slots__ = (
+        "source",
+        "names",
+        "root",
+        "definitions",
+        "nested_indexed",
+        "typedef_names",
+        "first_declarations",
+        "tag_types",
+        "converting",
+        "constants",
+    )
+
+    def __init__(self, source: bytes):
+        self.source = memoryview(source)
+        self.names = {}  # raw bytes of a name -> interned str
+        self.root = None  # root node of the tree being converted
+        self.definitions = {}  # tag key -> specifier node holding its body
+        self.nested_indexed = False  # whether records nested in others were searched
+        self.typedef_names = {}  # tag key -> name of the first typedef naming it
+        self.first_declarations = {}  # tag key -> start of its first top-level node
+        self.tag_types = {}  # tag key -> Type, with its members
+        self.converting = set()  # keys of the tags whose members are being converted
+        self.constants = {}  # enumerator name -> value
+
+    def text(self, node) -> str:
+        raw = self.source[node.start_byte : node.end_byte]
+        try:
+            return self.names[raw]  # a read-only memoryview hashes like its bytes
+        except KeyError:
+            name = self.names[raw.tobytes()] = sys.intern(str(raw, "utf-8"))
+            return name
+
+    def index_nested_definitions(self):
+        """Add the tags defined inside records to the index, searching the tree once."""
+        if self.nested_indexed:
+            return
+        self.nested_indexed = True
+        captures = tree_sitter.QueryCursor(TAG_DEFINITION_QUERY).captures(self.root)
+        for node in sorted(captures.get("definition", ()), key=lambda n: n.start_byte):
+            self.definitions.setdefault(tag_key(self, node), node)
+
+    def definition(self, key):
+        """Specifier node defining a tag, None for a tag that is only declared."""
+        if key not in self.definitions:
+            self.index_nested_definitions()
+        return self.definitions.get(key)
 
 
 ###########################################################################
 ###--------------------------Helper_Functions---------------------------###
 ###########################################################################
-def extract_src_text(node):
-    start = node.start_byte
-    end = node.end_byte
-    return header_source[start:end].decode()  # header_source is a global variable
 
 
 def sanitize_type(name: str) -> tuple:
-    return tuple(sorted(name.split()))
+    """Sorted words of a builtin type name, "int" dropped when it only completes it."""
+    words = name.split()
+    if len(words) > 1 and "int" in words:
+        words.remove("int")
+    return tuple(sorted(words))
 
 
 def sanitize_pointer(name: str) -> str:
     return re.sub(r"\*| ", "", name)
 
 
+def iter_leaves(node):
+    """Yield the leaves below node in source order."""
+    cursor = node.walk()
+    while True:
+        if cursor.goto_first_child():
+            continue
+        yield cursor.node
+        while not cursor.goto_next_sibling():
+            if not cursor.goto_parent():  # back at node
+                return
+
+
 ###########################################################################
 ###---------------------------Parsing_Types-----------------------------###
 ###########################################################################
-def parse_type(node) -> dict:
-    prim_types = {  # (<sorted tuple of words in type>) : (<type name>, <longness value>, <signed?>)
-        # float variants
-        "float": ("float", 0, True),
-        "double": ("float", 1, True),
-        "long double": ("float", 2, True),
-        # int variants
-        "int": ("int", 0, True),
-        "short": ("int", -1, True),
-        "long": ("int", 1, True),
-        "long long": ("int", 2, True),
-        "signed int": ("int", 0, True),
-        "signed short": ("int", -1, True),
-        "signed long": ("int", 1, True),
-        "signed long long": ("int", 2, True),
-        "unsigned int": ("int", 0, False),
-        "unsigned short": ("int", -1, False),
-        "unsigned long": ("int", 1, False),
-        "unsigned long long": ("int", 2, False),
-        # char variants
-        "char": ("char", 0, False),
-        "signed char": ("char", 0, True),
-        "unsigned char": ("char", 0, False),
-    }
+# (<sorted tuple of words in type>) : (<type name>, <longness value>, <signed?>)
+PRIM_TYPES = {
+    # float variants
+    "float": ("float", 0, True),
+    "double": ("float", 1, True),
+    "long double": ("float", 2, True),
+    # int variants
+    "int": ("int", 0, True),
+    "short": ("int", -1, True),
+    "long": ("int", 1, True),
+    "long long": ("int", 2, True),
+    "signed int": ("int", 0, True),
+    "signed short": ("int", -1, True),
+    "signed long": ("int", 1, True),
+    "signed long long": ("int", 2, True),
+    "unsigned int": ("int", 0, False),
+    "unsigned short": ("int", -1, False),
+    "unsigned long": ("int", 1, False),
+    "unsigned long long": ("int", 2, False),
+    # char variants
+    "char": ("char", 0, False),
+    "signed char": ("char", 0, True),
+    "unsigned char": ("char", 0, False),
+}
 
-    type = node.type
-    name = extract_src_text(node)
-    prim_types_sanitized = {sanitize_type(k): v for k, v in prim_types.items()}
-    prim_dict = {}
-    if name == "void":
-        prim_dict |= {"kind": "void"}
-    elif type not in ["primitive_type", "sized_type_specifier"]:
-        prim_dict |= {"kind": "custom_type", "name": name}
-    else:
-        # Turn type name into tuple for hashing in prim_types
-        type_tup = sanitize_type(name)
-        kind, longness, signed = prim_types_sanitized[type_tup]
-        # Append to dict necessary information based off of type
-        prim_dict |= {"kind": kind}
-        if longness != 0:
-            prim_dict |= {"longness": longness}
-        if kind == "char" and signed == True:
-            prim_dict |= {"signed": True}
-        if (kind == "int" or kind == "float") and signed == False:
-            prim_dict |= {"unsigned": True}
 
+def prim_type_dict(kind, longness, signed) -> dict:
+    prim_dict = {"kind": kind}
+    if longness != 0:
+        prim_dict |= {"longness": longness}
+    if kind == "char" and signed == True:
+        prim_dict |= {"signed": True}
+    if (kind == "int" or kind == "float") and signed == False:
+        prim_dict |= {"unsigned": True}
     return prim_dict
 
 
+# THAPI dict of each primitive type, by sorted tuple of its words
+PRIM_TYPE_DICTS = {sanitize_type(k): prim_type_dict(*v) for k, v in PRIM_TYPES.items()}
+
+
+@cache
+def lookup_prim_type(name: str) -> Type:
+    """Interned type of a primitive type as spelled in the source, None for other names."""
+    if (prim := PRIM_TYPE_DICTS.get(sanitize_type(name))) is None:
+        return None
+    return leaf_type(**prim)
+
+
+def parse_type(ctx, node) -> Type:
+    """Type named by a type specifier; structs, unions and enums by name only."""
+    match node.type:
+        case "primitive_type" | "sized_type_specifier":
+            name = ctx.text(node)
+            if name == "void":
+                return leaf_type("void")
+            if (prim := lookup_prim_type(name)) is None:
+                # size_t, uint32_t, ...: typedefs of the C library
+                return leaf_type("custom_type", name=name)
+            return prim
+        case "type_identifier":
+            return leaf_type("custom_type", name=ctx.text(node))
+        case "struct_specifier" | "union_specifier" | "enum_specifier":
+            key = tag_key(ctx, node)
+            return leaf_type(key[0], name=tag_name(ctx, key))
+        case _:
+            raise NotImplementedError(
+                f"Unhandled type form in parse_type(): #{node.type}"
+            )
+
+
+def parse_type_decl(ctx, spec, derivation=(), i=0) -> Type:
+    """Type of a declaration from derivation[i:] on, as the Clang parser gives it.
+
+    Pointers are left to the declarator, arrays only give their lengths and
+    structs, unions and enums come with their members.
+    """
+    if i == len(derivation):
+        if spec.type in TAG_KINDS:
+            return parse_tag_type(ctx, spec)
+        return parse_type(ctx, spec)
+    constructor, node = derivation[i]
+    match constructor:
+        case "pointer":
+            return parse_type_decl(ctx, spec, derivation, i + 1)
+        case "array":
+            element = None
+            if i + 1 < len(derivation) and derivation[i + 1][0] == "array":
+                element = parse_type_decl(ctx, spec, derivation, i + 1)
+            return Type("array", type=element, length=parse_length(ctx, node))
+        case _:
+            raise NotImplementedError(
+                f"Unhandled type form in parse_type_decl(): #{constructor}"
+            )
+
+
+def parse_type_param(ctx, spec, derivation=(), i=0) -> Type:
+    """Full type of a parameter from derivation[i:] on, structs named only."""
+    if i == len(derivation):
+        return parse_type(ctx, spec)
+    constructor, node = derivation[i]
+    match constructor:
+        case "pointer":
+            return Pointer(parse_type_param(ctx, spec, derivation, i + 1))
+        case "array":
+            return Type(
+                "array",
+                type=parse_type_param(ctx, spec, derivation, i + 1),
+                length=parse_length(ctx, node),
+            )
+        case _:
+            raise NotImplementedError(
+                f"Unhandled parameter type in parse_type_param(): #{constructor}"
+            )
+
+
+def parse_pointer(derivation, i=0):
+    """The chain of Pointer nodes starting at derivation[i], None if there is none."""
+    pointer = None
+    while i < len(derivation) and derivation[i][0] == "pointer":
+        pointer = Pointer(pointer)
+        i += 1
+    return pointer
+
+
+###########################################################################
+###--------------------------Parsing_Constants--------------------------###
+###########################################################################
+def c_division(a: int, b: int) -> int:
+    """Integer division truncating toward zero, as in C."""
+    q = abs(a) // abs(b)
+    return q if (a < 0) == (b < 0) else -q
+
+
+UNARY_OPERATORS = {
+    "-": operator.neg,
+    "+": operator.pos,
+    "~": operator.invert,
+    "!": lambda a: int(not a),
+}
+
+BINARY_OPERATORS = {
+    "+": operator.add,
+    "-": operator.sub,
+    "*": operator.mul,
+    "/": c_division,
+    "%": lambda a, b: a - b * c_division(a, b),
+    "<<": operator.lshift,
+    ">>": operator.rshift,
+    "&": operator.and_,
+    "|": operator.or_,
+    "^": operator.xor,
+    "&&": lambda a, b: int(bool(a and b)),
+    "||": lambda a, b: int(bool(a or b)),
+    "==": lambda a, b: int(a == b),
+    "!=": lambda a, b: int(a != b),
+    "<": lambda a, b: int(a < b),
+    ">": lambda a, b: int(a > b),
+    "<=": lambda a, b: int(a <= b),
+    ">=": lambda a, b: int(a >= b),
+}
+
+# Tokens that may come before the literal of an enumerator value
+LEADING_PUNCTUATION = {"+", "-", "("}
+
+
+def parse_int(literal: str) -> int:
+    # tree-sitter folds the sign of a negative literal into the literal
+    if literal.startswith("-"):
+        return -parse_int(literal[1:])
+    digits = literal.rstrip("uUlL")
+    if len(digits) > 1 and digits[0] == "0" and digits[1].isdigit():
+        return int(digits, 8)
+    return int(digits, 0)
+
+
+# Values of the escape sequences made of a backslash and one character
+SIMPLE_ESCAPES = {
+    "a": 7,
+    "b": 8,
+    "f": 12,
+    "n": 10,
+    "r": 13,
+    "t": 9,
+    "v": 11,
+    "\\": 92,
+    "'": 39,
+    '"': 34,
+    "?": 63,
+}
+
+
+def parse_char(literal: str) -> int:
+    """Value of a character literal, a plain one being a signed char as on x86."""
+    prefix, _, body = literal.partition("'")
+    body = body[:-1]
+    if len(body) == 1:
+        value = ord(body)
+    elif not body.startswith("\\"):
+        raise NotImplementedError(
+            f"Unhandled character literal in parse_char(): #{literal}"
+        )
+    elif (escape := body[1]) in SIMPLE_ESCAPES:
+        value = SIMPLE_ESCAPES[escape]
+    elif escape in "xuU":
+        value = int(body[2:], 16)
+    else:
+        value = int(body[1:], 8)
+    if not prefix and value > 127:
+        value -= 256
+    return value
+
+
+def evaluate(ctx, node) -> int:
+    """Value of an integer constant expression (enumerator value, array length)."""
+    match node.type:
+        case "number_literal":
+            return parse_int(ctx.text(node))
+        case "char_literal":
+            return parse_char(ctx.text(node))
+        case "identifier":
+            return lookup_constant(ctx, ctx.text(node))
+        case "parenthesized_expression":
+            return evaluate(ctx, node.named_children[0])
+        case "cast_expression":
+            return evaluate(ctx, node.child_by_field_id(VALUE_FIELD))
+        case "unary_expression":
+            op = ctx.text(node.child_by_field_id(OPERATOR_FIELD))
+            return UNARY_OPERATORS[op](
+                evaluate(ctx, node.child_by_field_id(ARGUMENT_FIELD))
+            )
+        case "binary_expression":
+            op = ctx.text(node.child_by_field_id(OPERATOR_FIELD))
+            return BINARY_OPERATORS[op](
+                evaluate(ctx, node.child_by_field_id(LEFT_FIELD)),
+                evaluate(ctx, node.child_by_field_id(RIGHT_FIELD)),
+            )
+        case "conditional_expression":
+            if evaluate(ctx, node.child_by_field_id(CONDITION_FIELD)):
+                return evaluate(ctx, node.child_by_field_id(CONSEQUENCE_FIELD))
+            return evaluate(ctx, node.child_by_field_id(ALTERNATIVE_FIELD))
+        case _:
+            raise NotImplementedError(
+                f"Unhandled constant expression in evaluate(): #{node.type}"
+            )
+
+
+def lookup_constant(ctx, name: str) -> int:
+    """Value of an enumerator, converting the enums of the header until it is found."""
+    try:
+        return ctx.constants[name]
+    except KeyError:
+        pass
+    ctx.index_nested_definitions()
+    for key, node in list(ctx.definitions.items()):
+        if key[0] == "enum" and key not in ctx.tag_types and key not in ctx.converting:
+            parse_tag_type(ctx, node)
+            if name in ctx.constants:
+                return ctx.constants[name]
+    raise NotImplementedError(f"Unknown constant in lookup_constant(): #{name}")
+
+
+def parse_length(ctx, node):
+    """Length of an array declarator from its size node, None when unsized."""
+    if node is None:
+        return None
+    return int_value(evaluate(ctx, node))
+
+
+def is_hex(ctx, node) -> bool:
+    """Tell whether the first literal of an enumerator value is hexadecimal."""
+    for leaf in iter_leaves(node):
+        if leaf.type in LEADING_PUNCTUATION:
+            continue
+        if leaf.type != "number_literal":
+            return False
+        return ctx.text(leaf).lstrip("-").startswith(("0x", "0X"))
+    return False
+
+
 ###########################################################################
 ###----------------------Parsing_Translation_Unit-----------------------###
 ###########################################################################
-def parse_translation_unit(tree) -> dict:
-    entities = []
-    for node in tree.children:
+# Nodes whose main branch holds top-level declarations
+CONTAINER_NODE_TYPES = {
+    "translation_unit",
+    "preproc_if",
+    "preproc_ifdef",
+    "linkage_specification",
+    "declaration_list",
+}
+# Fields of a container that are not part of its main branch
+SKIPPED_FIELDS = {"name", "condition", "alternative", "value"}
+# Top-level nodes producing no entity
+SKIPPED_NODE_TYPES = {
+    "comment",
+    "preproc_call",
+    "preproc_def",
+    "preproc_function_def",
+    "preproc_include",
+}
+
+
+def iter_top_level(root):
+    """Yield the top-level declaration nodes of a tree, in source order.
+
+    Conditional groups are entered through their main branch (#else branches
+    are skipped, as the preprocessor of an include guard would), and so are
+    extern "C" blocks.
+    """
+    cursor = root.walk()
+    if not cursor.goto_first_child():
+        return
+    depth = 0
+    while True:
+        node = cursor.node
+        if node.is_named and cursor.field_name not in SKIPPED_FIELDS:
+            if node.type not in CONTAINER_NODE_TYPES:
+                yield node
+            elif cursor.goto_first_child():
+                depth += 1
+                continue
+        while not cursor.goto_next_sibling():
+            if depth == 0:
+                return
+            cursor.goto_parent()
+            depth -= 1
+
+
+def build_tag_index(ctx, root, nodes) -> list:
+    """Record the tags the top-level nodes declare and the typedefs naming them.
+
+    Like the Clang parser's typedef index, a tag is merged with the first typedef
+    naming it directly. Return the nodes declaring a tag: they are the only ones
+    whose entities depend on other nodes.
+    """
+    ctx.root = root
+    tag_nodes = []
+    for node in nodes:
+        spec = node if node.type in TAG_KINDS else node.child_by_field_id(TYPE_FIELD)
+        if spec is None or spec.type not in TAG_KINDS:
+            continue
+        tag_nodes.append(node)
+        key = tag_key(ctx, spec)
+        if spec.child_by_field_id(BODY_FIELD) is not None:
+            ctx.definitions.setdefault(key, spec)
+        ctx.first_declarations.setdefault(key, node.start_byte)
+        if node.type == "type_definition":
+            for declarator in node.children_by_field_id(DECLARATOR_FIELD):
+                if declarator.type == "type_identifier":
+                    ctx.typedef_names.setdefault(key, ctx.text(declarator))
+    return tag_nodes
+
+
+def parse_entities(ctx, node) -> list:
+    """Entities of a top-level node, in source order.
+
+    A node using a construct the parser does not handle (an enumerator value
+    referring to a macro, say) is reported on stderr and gives no entity, so the
+    rest of the header is still converted.
+    """
+    try:
         match node.type:
-            case "declaration":
-                entities.append(parse_decl(node))
+            case "declaration" | "function_definition":
+                return parse_decl(ctx, node)
             case "type_definition":
-                entities.append(parse_typedef(node))
-            case "comment":
-                continue
+                return parse_typedef(ctx, node)
+            case "struct_specifier" | "union_specifier" | "enum_specifier":
+                return [parse_tag_decl(ctx, node)]
+            case node_type if node_type in SKIPPED_NODE_TYPES:
+                return []
             case _:
                 raise NotImplementedError(
                     f"Unhandled entity form in parse_translation_unit(): #{node.type}"
                 )
+    except NotImplementedError as e:
+        line = node.start_point[0] + 1
+        print(f"line {line}: {type(e).__name__}: {e}", file=sys.stderr)
+        return []
+
+
+def iter_translation_unit(ctx, tree):
+    """Yield the top-level entities of the tree one at a time."""
+    nodes = list(iter_top_level(tree))
+    build_tag_index(ctx, tree, nodes)
+    for node in nodes:
+        yield from parse_entities(ctx, node)
+
+
+def parse_translation_unit(ctx, tree) -> dict:
+    entities = list(iter_translation_unit(ctx, tree))
     return {"kind": "translation_unit", "entities": entities}
 
 
+def parse_source(source: bytes) -> dict:
+    """Convert the source of a header to a translation_unit dict."""
+    tree = tree_sitter.Parser(C_LANGUAGE).parse(source)
+    return parse_translation_unit(ParseContext(source), tree.root_node)
+
+
 ###########################################################################
-###------------------------Parsing_Declarations-------------------------###
+###-------------------------Parsing_Declarators-------------------------###
 ###########################################################################
-def parse_decl(node) -> dict:
-    match types := [child_node.type for child_node in node.children]:
-        case (
-            ["primitive_type", "function_declarator", ";"]
-            | ["sized_type_specifier", "function_declarator", ";"]
-            | ["type_identifier", "function_declarator", ";"]
-        ):
-            decl_dict = parse_func(node)
-        case (
-            ["primitive_type", "pointer_declarator", ";"]
-            | ["size_type_specifier", "pointer_declarator", ";"]
-            | ["type_identifier", "pointer_declarator", ";"]
-        ):
-            decl_dict = parse_pointer_decl(node)
-        case _:
-            raise NotImplementedError(
-                f"Unhandled delcaration form in parse_decl(): #{types}"
-            )
-    return {"kind": "declaration"} | decl_dict
+def parse_declarator(ctx, node) -> tuple:
+    """(name, derivation) of a declarator, the name of an abstract one being "".
 
+    The derivation lists the (constructor, node) pairs the declarator applies to
+    its base type, outermost first: `*f(void)` gives [("function", <parameter
+    list>), ("pointer", None)], a function returning a pointer. Array entries
+    hold their size node.
+    """
+    derivation = []
+    name = ""
+    while node is not None:
+        match node.type:
+            case "pointer_declarator" | "abstract_pointer_declarator":
+                derivation.append(("pointer", None))
+            case "array_declarator" | "abstract_array_declarator":
+                derivation.append(("array", node.child_by_field_id(SIZE_FIELD)))
+            case "function_declarator" | "abstract_function_declarator":
+                derivation.append(
+                    ("function", node.child_by_field_id(PARAMETERS_FIELD))
+                )
+            case "parenthesized_declarator" | "abstract_parenthesized_declarator":
+                node = node.named_children[0]
+                continue
+            case "identifier" | "field_identifier" | "type_identifier":
+                name = ctx.text(node)
+                break
+            case _:
+                raise NotImplementedError(
+                    f"Unhandled declarator form in parse_declarator(): #{node.type}"
+                )
+        node = node.child_by_field_id(DECLARATOR_FIELD)
+    derivation.reverse()
+    return name, derivation
 
-def parse_pointer_decl(node, points=0, ret_type_dict={}) -> dict:
-    match types := [child_node.type for child_node in node.children]:
-        case (
-            ["primitive_type", "pointer_declarator", ";"]
-            | ["size_type_specifier", "pointer_declarator", ";"]
-            | ["type_identifier", "pointer_declarator", ";"]
-        ):
-            type_node, decl_node, _ = node.children
-            return parse_pointer_decl(decl_node, points + 1, parse_type(type_node))
-        case ["*", "pointer_declarator"]:
-            (
-                _,
-                decl_node,
-            ) = node.children
-            return parse_pointer_decl(decl_node, points + 1, ret_type_dict)
-        case ["*", "function_declarator"]:
-            return parse_func(node, points, ret_type_dict)
-        case _:
+
+###########################################################################
+###------------------------Parsing_Declarations-------------------------###
+###########################################################################
+def parse_decl(ctx, node) -> list:
+    spec = node.child_by_field_id(TYPE_FIELD)
+    entities = parse_tag_declaration(ctx, node, spec)
+    for declarator in node.children_by_field_id(DECLARATOR_FIELD):
+        name, derivation = parse_declarator(ctx, declarator)
+        if not derivation or derivation[0][0] != "function":
             raise NotImplementedError(
-                f"Unhandled pointer declaration form in parse_pointer_decl(): #{types}"
+                f"Unhandled delcaration form in parse_decl(): #{declarator.type}"
             )
+        entities.append(parse_func(ctx, spec, name, derivation))
+    return entities
 
 
 ###########################################################################
 ###-------------------------Parsing_Functions---------------------------###
 ###########################################################################
-def parse_func(node, points=0, ret_type_dict={}) -> dict:
-    match types := [child_node.type for child_node in node.children]:
-        case (
-            ["primitive_type", "function_declarator", ";"]
-            | ["sized_type_specifier", "function_declarator", ";"]
-            | ["type_identifier", "function_declarator", ";"]
-        ):
-            ret_type_node, func_decl_node, _ = node.children
-            ret_type_dict = parse_type(ret_type_node)
-            func_name, params = parse_func_decl(func_decl_node)
-            pointer_dict = {}
-        case [
-            "*",
-            "function_declarator",
-        ]:  # When return type is a pointer (return value is stored with the first pointer higher in the AST)
-            _, func_decl_node = node.children
-            func_name, params = parse_func_decl(func_decl_node)
-            pointer_dict = {"type": {"kind": "pointer"}}
-            while points > 1:
-                pointer_dict = {"type": {"kind": "pointer"} | pointer_dict}
-                points -= 1
-        case _:
-            raise NotImplementedError(
-                f"Unhandled function form in parse_func(): #{types}"
+def parse_func(ctx, spec, name, derivation) -> Declaration:
+    params = parse_params(ctx, derivation[0][1])
+    return Declaration(
+        parse_type_decl(ctx, spec, derivation, 1),
+        [
+            Declarator(
+                name,
+                Type(
+                    "function",
+                    type=parse_pointer(derivation, 1),
+                    params=params or None,
+                ),
             )
-
-    return {
-        "type": ret_type_dict,
-        "declarators": [
-            {
-                "kind": "declarator",
-                "indirect_type": {"kind": "function"}
-                | pointer_dict
-                | {"params": params},
-                "name": func_name,
-            }
         ],
-    }
-
-
-def parse_func_decl(node) -> tuple:
-    match types := [child_node.type for child_node in node.children]:
-        case ["identifier", "parameter_list"]:
-            func_node, params_node = node.children
-            return (extract_src_text(func_node), parse_params(params_node))
-        case _:
-            raise NotImplementedError(
-                f"Unhandled funcation delcaration form in parse_func_decl(): #{types}"
-            )
+    )
 
 
 ###########################################################################
 ###-------------------------Parsing_Parameters--------------------------###
 ###########################################################################
-def parse_params(params_node) -> list:
+def parse_params(ctx, params_node) -> list:
     params = []
     # loop through and record parameters
     for node in params_node.named_children:
-        type_node, decl_node = node.children
-        match types := [child_node.type for child_node in node.children]:
-            case (
-                ["primitive_type", "identifier"]
-                | ["sized_type_specifier", "identifier"]
-                | ["type_identifier", "identifier"]
-            ):
-                type_dict = parse_type(type_node)
-                decl_name = extract_src_text(decl_node)
-            case (
-                ["primitive_type", "pointer_declarator"]
-                | ["sized_type_specifier", "pointer_declarator"]
-                | ["type_identifier", "pointer_declarator"]
-            ):
-                decl_name, type_dict = parse_pointer_param(
-                    parse_type(type_node), decl_node
-                )
+        match node.type:
+            case "parameter_declaration":
+                spec = node.child_by_field_id(TYPE_FIELD)
+                declarator = node.child_by_field_id(DECLARATOR_FIELD)
+                if declarator is None:
+                    if ctx.text(spec) == "void":  # f(void)
+                        continue
+                    name, derivation = "", ()
+                else:
+                    name, derivation = parse_declarator(ctx, declarator)
+                params.append(Parameter(parse_type_param(ctx, spec, derivation), name))
+            case "variadic_parameter" | "comment":
+                continue
             case _:
                 raise NotImplementedError(
-                    f"Unhandled function parameter type in parser_params(): #{types}"
+                    f"Unhandled function parameter type in parser_params(): #{node.type}"
                 )
-        params.append({"kind": "parameter", "type": type_dict, "name": decl_name})
-
     return params
 
 
-def parse_pointer_param(type, node) -> tuple:
-    match types := [child_node.type for child_node in node.children]:
-        case ["*", "identifier"]:
-            _, id_node = node.children
-            return (
-                extract_src_text(id_node),
-                {"kind": "pointer", "type": type},
-            )
-        case ["*", "pointer_declarator"] | ["primitive_type", "pointer_declarator"]:
-            _, ptr_decl_node = node.children
-            decl_name, type_dict = parse_pointer_param(type, ptr_decl_node)
-            return (decl_name, {"kind": "pointer", "type": type_dict})
-        case _:
-            raise NotImplementedError(
-                f"Unexpected declarator in parse_pointer_param(): #{types}"
+###########################################################################
+###----------------------Parsing_Type_Definitions-----------------------###
+###########################################################################
+def parse_typedef(ctx, node) -> list:
+    spec = node.child_by_field_id(TYPE_FIELD)
+    entities = parse_tag_declaration(ctx, node, spec)
+    for declarator in node.children_by_field_id(DECLARATOR_FIELD):
+        name, derivation = parse_declarator(ctx, declarator)
+        if not derivation and spec.type in TAG_KINDS:
+            continue  # merged into the entity of the tag
+        entities.append(
+            Declaration(
+                parse_type_decl(ctx, spec, derivation),
+                [Declarator(name, parse_pointer(derivation))],
+                storage=":typedef",
             )
+        )
+    return entities
 
 
 ###########################################################################
-###----------------------Parsing_Type_Definitions-----------------------###
+###---------------------Parsing_Structs_Unions_Enums--------------------###
 ###########################################################################
-def parse_typedef(node) -> dict:
-    _, type_node, decl_node, _ = node.children
-    type_dict = parse_type(type_node)
-    match types := [child_node.type for child_node in node.children]:
-        case (
-            ["typedef", "primitive_type", "type_identifier", ";"]
-            | ["typedef", "type_identifier", "type_identifier", ";"]
-            | ["typedef", "sized_type_specifier", "type_identifier", ";"]
-        ):
-            decl = {"kind": "declarator", "name": extract_src_text(decl_node)}
-        case (
-            ["typedef", "primitive_type", "pointer_declarator", ";"]
-            | ["typedef", "type_identifier", "pointer_declarator", ";"]
-            | ["typedef", "sized_type_specifier", "pointer_declarator", ";"]
+# Specifier node type -> kind of the tag
+TAG_KINDS = {
+    "struct_specifier": "struct",
+    "union_specifier": "union",
+    "enum_specifier": "enum",
+}
+
+
+def tag_key(ctx, node) -> tuple:
+    """Identity of a tag: (kind, name, None), or (kind, None, position) if anonymous."""
+    name = node.child_by_field_id(NAME_FIELD)
+    if name is None:
+        return (TAG_KINDS[node.type], None, node.start_byte)
+    return (TAG_KINDS[node.type], ctx.text(name), None)
+
+
+def tag_name(ctx, key):
+    """Name of a tag; an anonymous one takes the name of its typedef, as in Clang."""
+    return key[1] or ctx.typedef_names.get(key)
+
+
+def parse_tag_declaration(ctx, node, spec) -> list:
+    """Entity of the tag declared by the type specifier of a top-level node, if any.
+
+    A definition always declares its tag, a reference only when no earlier
+    declaration is visible, as in `struct foo *make_foo(void);`.
+    """
+    if spec.type not in TAG_KINDS:
+        return []
+    if spec.child_by_field_id(BODY_FIELD) is None:
+        key = tag_key(ctx, spec)
+        if ctx.first_declarations.get(key) != node.start_byte:
+            return []
+        definition = ctx.definition(key)
+        if definition is not None and definition.start_byte < node.start_byte:
+            return []  # defined inside an earlier record
+    return [parse_tag_decl(ctx, spec)]
+
+
+def parse_tag_decl(ctx, node) -> Declaration:
+    """Entity of a struct, union or enum, merged with the first typedef naming it."""
+    tag_type = parse_tag_type(ctx, node)
+    if (name := ctx.typedef_names.get(tag_key(ctx, node))) is not None:
+        return Declaration(tag_type, [Declarator(name)], storage=":typedef")
+    return Declaration(tag_type)
+
+
+def parse_tag_type(ctx, node) -> Type:
+    """Type of a struct, union or enum with the members of its definition.
+
+    Types are shared by every reference to the tag within the header.
+    """
+    key = tag_key(ctx, node)
+    try:
+        return ctx.tag_types[key]
+    except KeyError:
+        pass
+    if key in ctx.converting:  # a record referring to itself
+        return leaf_type(key[0], name=tag_name(ctx, key))
+    body = node.child_by_field_id(BODY_FIELD)
+    if body is None and (definition := ctx.definition(key)) is not None:
+        body = definition.child_by_field_id(BODY_FIELD)
+    members = None
+    if body is not None:
+        ctx.converting.add(key)
+        try:
+            if key[0] == "enum":
+                members = parse_enumerators(ctx, body)
+            else:
+                members = parse_fields(ctx, body)
+        finally:
+            ctx.converting.discard(key)
+    tag_type = ctx.tag_types[key] = Type(
+        key[0], name=tag_name(ctx, key), members=members or None
+    )
+    return tag_type
+
+
+def parse_fields(ctx, body) -> list:
+    members = []
+    for node in body.named_children:
+        match node.type:
+            case "field_declaration":
+                spec = node.child_by_field_id(TYPE_FIELD)
+                declarators = node.children_by_field_id(DECLARATOR_FIELD)
+                if not declarators:  # anonymous struct or union member
+                    members.append(parse_field(ctx, spec, "", ()))
+                for declarator in declarators:
+                    name, derivation = parse_declarator(ctx, declarator)
+                    members.append(parse_field(ctx, spec, name, derivation))
+            case "comment":
+                continue
+            case _:
+                raise NotImplementedError(
+                    f"Unhandled member form in parse_fields(): #{node.type}"
+                )
+    return members
+
+
+def parse_field(ctx, spec, name, derivation) -> Declaration:
+    if derivation and derivation[0][0] == "array":
+        # The declarator holds the array dimensions, the type their element
+        i = 1
+        while i < len(derivation) and derivation[i][0] == "array":
+            i += 1
+        return Declaration(
+            parse_type_decl(ctx, spec, derivation, i),
+            [Declarator(name, parse_type_decl(ctx, spec, derivation))],
+        )
+    return Declaration(
+        parse_type_decl(ctx, spec, derivation),
+        [Declarator(name, parse_pointer(derivation))],
+    )
+
+
+def parse_enumerators(ctx, body) -> list:
+    members = []
+    value = -1
+    for node in body.named_children:
+        match node.type:
+            case "enumerator":
+                name = ctx.text(node.child_by_field_id(NAME_FIELD))
+                if (value_node := node.child_by_field_id(VALUE_FIELD)) is None:
+                    value, hex = value + 1, False
+                else:
+                    value, hex = evaluate(ctx, value_node), is_hex(ctx, value_node)
+                ctx.constants[name] = value
+                members.append(Enumerator(name, int_value(value, hex)))
+            case "comment":
+                continue
+            case _:
+                raise NotImplementedError(
+                    f"Unhandled enumerator form in parse_enumerators(): #{node.type}"
+                )
+    return members
+
+
+###########################################################################
+###-------------------------Incremental_Parsing-------------------------###
+###########################################################################
+# Step sizes of the common prefix/suffix scans: memcmp of large slices first
+SCAN_STEPS = (4096, 64, 1)
+
+
+def common_prefix_length(a: bytes, b: bytes) -> int:
+    n = min(len(a), len(b))
+    i = 0
+    for step in SCAN_STEPS:
+        while i + step <= n and a[i : i + step] == b[i : i + step]:
+            i += step
+    return i
+
+
+def common_suffix_length(a: bytes, b: bytes, limit: int) -> int:
+    i = 0
+    for step in SCAN_STEPS:
+        while (
+            i + step <= limit
+            and a[len(a) - i - step : len(a) - i] == b[len(b) - i - step : len(b) - i]
         ):
-            decl_name, ptr_dict = parse_pointer_typedef(decl_node)
-            decl = {
-                "kind": "declarator",
-                "indirect_type": ptr_dict,
-                "name": decl_name,
-            }
-        case _:
-            raise NotImplementedError(f"Unhandled case in parse_typdef(): #{types}")
+            i += step
+    return i
+
+
+def point_at(source: bytes, offset: int) -> tuple:
+    """(row, column) of a byte offset, the column counted in bytes as tree-sitter does."""
+    row = source.count(b"\n", 0, offset)
+    return (row, offset - (source.rfind(b"\n", 0, offset) + 1))
+
+
+def source_edit(old: bytes, new: bytes) -> dict:
+    """Tree.edit() arguments turning old into new, as one replaced byte range."""
+    start = common_prefix_length(old, new)
+    # The common suffix must not overlap the common prefix in either source
+    suffix = common_suffix_length(old, new, min(len(old), len(new)) - start)
+    old_end, new_end = len(old) - suffix, len(new) - suffix
     return {
-        "kind": "declaration",
-        "storage": ":typedef",
-        "type": type_dict,
-        "declarators": [decl],
+        "start_byte": start,
+        "old_end_byte": old_end,
+        "new_end_byte": new_end,
+        "start_point": point_at(old, start),
+        "old_end_point": point_at(old, old_end),
+        "new_end_point": point_at(new, new_end),
     }
 
 
-def parse_pointer_typedef(node) -> tuple:
-    match types := [child_node.type for child_node in node.children]:
-        case ["*", "type_identifier"]:
-            _, type_id_node = node.children
-            return (extract_src_text(type_id_node), {"kind": "pointer"})
-        case ["*", "pointer_declarator"]:
-            _, ptr_decl_node = node.children
-            decl_name, pointer_dict = parse_pointer_typedef(ptr_decl_node)
-            return (
-                decl_name,
-                {
-                    "kind": "pointer",
-                    "type": pointer_dict,
-                },
-            )
-        case _:
-            raise NotImplementedError(
-                f"Unexpected declarator in parse_pointer_typedef(): #{types}"
-            )
+class IncrementalParser:
+    """Keep the tree of a header across edits, converting only the entities that changed.
+
+    update() feeds the edit between the previous and the new source to
+    tree-sitter, which then reparses incrementally. Entities and their YAML are
+    cached by the source text of their top-level node. Every node whose text is
+    unchanged reuses them, so the conversion cost follows the edited
+    declarations, not the size of the file. Nodes declaring structs, unions or
+    enums depend on each other (typedef merging, members of forward-declared
+    tags), so any change to one of them drops the whole cache.
+    """
+
+    def __init__(self, dumper=emitter.BACKENDS["auto"]):
+        self.parser = tree_sitter.Parser(C_LANGUAGE)
+        self.dumper = dumper
+        self.source = None  # source of self.tree
+        self.tree = None
+        self.entities_source = None  # source self.entities were converted from
+        self.entities = []
+        # Top-level node key -> (its entities, their YAML texts or None until dumped)
+        self.cache = {}
+        self.keys = []  # cache keys of the nodes of self.entities, in order
+        self.tag_sources = None  # text of the nodes declaring tags, in order
+        self.converted = 0
+
+    def update(self, source: bytes) -> list:
+        """Parse the new source of the header and return its entities."""
+        if source == self.entities_source:
+            self.converted = 0
+            return self.entities
+        if self.tree is None:
+            self.tree = self.parser.parse(source)
+        else:
+            self.tree.edit(**source_edit(self.source, source))
+            self.tree = self.parser.parse(source, self.tree)
+        self.source = source
+        ctx = ParseContext(source)
+        root = self.tree.root_node
+        nodes = list(iter_top_level(root))
+        tag_nodes = build_tag_index(ctx, root, nodes)
+        tag_sources = [node.text for node in tag_nodes]
+        previous = self.cache if tag_sources == self.tag_sources else {}
+        # Identical nodes declaring tags may differ by position: `struct foo *f(void);`
+        # declares foo only the first time
+        tag_indexes = {node.start_byte: i for i, node in enumerate(tag_nodes)}
+        cache, keys, converted = {}, [], 0
+        for node in nodes:
+            key = (node.type, node.text, tag_indexes.get(node.start_byte))
+            if (cached := cache.get(key) or previous.get(key)) is None:
+                cached = (parse_entities(ctx, node), None)
+                converted += 1
+            cache[key] = cached
+            if cached[0]:
+                keys.append(key)
+        self.cache = cache
+        self.keys = keys
+        self.tag_sources = tag_sources
+        self.entities = [entity for key in keys for entity in cache[key][0]]
+        self.entities_source = source
+        self.converted = converted
+        return self.entities
+
+    def write(self, stream):
+        """Write the YAML document of the last update, dumping only new entities."""
+        texts = []
+        for key in self.keys:
+            entities, node_texts = self.cache[key]
+            if node_texts is None:
+                node_texts = [
+                    emitter.dump_entity(entity, self.dumper) for entity in entities
+                ]
+                self.cache[key] = (entities, node_texts)
+            texts.extend(node_texts)
+        emitter.write_entity_texts(texts, stream)
+
+
+def watch(path, output=None, dumper=emitter.BACKENDS["auto"], interval=0.5):
+    """Regenerate the YAML of path every time it changes, until interrupted."""
+    parser = IncrementalParser(dumper)
+    last_stat = None
+    while True:
+        try:
+            st = os.stat(path)
+            if (st.st_mtime_ns, st.st_size) != last_stat:
+                last_stat = (st.st_mtime_ns, st.st_size)
+                with open(path, "rb") as f:
+                    source = f.read()
+                start = time.perf_counter()
+                parser.update(source)
+                if output:
+                    with open(output, "w") as f:
+                        parser.write(f)
+                else:
+                    parser.write(sys.stdout)
+                    sys.stdout.flush()
+                print(
+                    f"{path}: {len(parser.entities)} entities, {parser.converted} "
+                    f"converted in {(time.perf_counter() - start) * 1000:.1f} ms",
+                    file=sys.stderr,
+                )
+        except Exception as e:  # keep watching through half-edited headers
+            print(f"{path}: {type(e).__name__}: {e}", file=sys.stderr)
+        time.sleep(interval)
 
 
 ###########################################################################
-###----------------------------Main_Function----------------------------###
+###-------------------------Parallel_Conversion-------------------------###
 ###########################################################################
-if __name__ == "__main__":
-    args = len(sys.argv)
-    if args != 2:
-        raise ValueError(
-            "INCORRECT NUMBER OF ARGS\nUsage: python3 parser.py <header file path>"
+# Byte-range chunks per worker process: smaller chunks even out the load
+CHUNKS_PER_JOB = 4
+
+# Per-process state of the workers: the header they convert, parsed and indexed once
+worker_tree = None
+worker_ctx = None
+worker_nodes = None
+worker_starts = None  # start byte of each node of worker_nodes
+worker_dumper = None
+
+
+def init_worker(source, dumper):
+    global worker_tree, worker_ctx, worker_nodes, worker_starts, worker_dumper
+    worker_tree = tree_sitter.Parser(C_LANGUAGE).parse(source)
+    worker_ctx = ParseContext(source)
+    worker_nodes = list(iter_top_level(worker_tree.root_node))
+    build_tag_index(worker_ctx, worker_tree.root_node, worker_nodes)
+    worker_starts = [node.start_byte for node in worker_nodes]
+    worker_dumper = dumper
+
+
+def convert_chunk(start, end, keep_entities=False) -> tuple:
+    """(YAML text, entities or None) of the top-level nodes starting in [start, end)."""
+    entities = []
+    first, last = bisect_left(worker_starts, start), bisect_left(worker_starts, end)
+    for node in worker_nodes[first:last]:
+        entities.extend(parse_entities(worker_ctx, node))
+    text = emitter.dump_entities(entities, worker_dumper)
+    return text, entities if keep_entities else None
+
+
+def chunk_ranges(size: int, chunks: int) -> list:
+    """Split [0, size) into at most chunks consecutive byte ranges."""
+    step = max(-(-size // chunks), 1)
+    return [(start, min(start + step, size)) for start in range(0, size, step)]
+
+
+def convert_parallel(
+    source, jobs, dumper=emitter.BACKENDS["auto"], keep_entities=False
+):
+    """Convert a header over jobs worker processes, yielding (text, entities) per chunk.
+
+    The top-level nodes are split into byte ranges by their start. Every worker
+    parses the whole source once, since entities depend on the struct, typedef
+    and enumerator declarations of the entire header, then converts and dumps
+    the ranges it is handed. Chunks are yielded in source order, so joining
+    their texts gives the document of a serial run. Entities are only sent back
+    when keep_entities is set.
+    """
+    ranges = chunk_ranges(len(source), jobs * CHUNKS_PER_JOB)
+    with ProcessPoolExecutor(
+        jobs, initializer=init_worker, initargs=(source, dumper)
+    ) as pool:
+        yield from pool.map(
+            convert_chunk,
+            [start for start, _ in ranges],
+            [end for _, end in ranges],
+            repeat(keep_entities),
         )
 
-    with open(sys.argv[1], "rb") as file:
-        header_source = file.read()
-
-    C_LANGUAGE = tree_sitter.Language(tree_sitter_c.language())
-    parser = tree_sitter.Parser(C_LANGUAGE)
-    tree = parser.parse(header_source)
-    yaml_dict = parse_translation_unit(tree.root_node)
-    yaml.Dumper.ignore_aliases = lambda *args: True
-    print(
-        yaml.dump(
-            yaml_dict, sort_keys=False, explicit_start=True, default_flow_style=False
-        ).strip()
+
+###########################################################################
+###--------------------------------Daemon-------------------------------###
+###########################################################################
+# Headers whose IncrementalParser a --serve worker keeps
+SERVED_HEADERS = 16
+
+# IncrementalParser of each header a --serve worker converted, least recently used first
+server_parsers = OrderedDict()
+server_results = None
+server_dumper = None
+
+
+def init_server_worker(result_cache, yaml_backend):
+    global server_results, server_dumper
+    server_results = result_cache
+    server_dumper = emitter.get_dumper(yaml_backend)
+
+
+def convert_request(request):
+    """The document answering a --serve request (see Common/server.py).
+
+    Every header keeps its IncrementalParser: a header requested again is
+    reparsed incrementally, and only its changed declarations are converted.
+    """
+    if request.get("args"):
+        raise ValueError("the Tree-sitter parser takes no compiler arguments")
+    path = os.path.abspath(request["header"])
+    binary = request.get("format") == "binary"
+    if server_results and not binary:
+        if (document := server_results.get_document(path)) is not None:
+            return document
+    with open(path, "rb") as f:
+        source = f.read()
+    parser = server_parsers.pop(path, None) or IncrementalParser(server_dumper)
+    server_parsers[path] = parser
+    if len(server_parsers) > SERVED_HEADERS:
+        server_parsers.popitem(last=False)
+    entities = parser.update(source)
+    if server_results:
+        server_results.put(path, None, entities)
+    if binary:
+        return binformat.dumps({"kind": "translation_unit", "entities": entities})
+    document = io.StringIO()
+    parser.write(document)
+    if server_results:
+        server_results.put_document(path, None, document.getvalue())
+    return document.getvalue()
+
+
+###########################################################################
+###----------------------------Main_Function----------------------------###
+###########################################################################
+def make_result_cache(directory, max_bytes=DEFAULT_MAX_BYTES):
+    """ResultCache for this parser: its version covers the source and the grammar."""
+    common = Path(__file__).parent.parent / "Common"
+    # emitter.py writes the cached documents
+    version = parser_version(
+        [__file__, common / "ir.py", common / "emitter.py"],
+        **{
+            name: importlib.metadata.version(name)
+            for name in ("tree-sitter", "tree-sitter-c")
+        },
+    )
+    return ResultCache(directory, "tree_sitter", version, max_bytes)
+
+
+# Functions timed by --profile
+PROFILED_FUNCTIONS = [
+    "build_tag_index",
+    "parse_entities",
+    "parse_decl",
+    "parse_func",
+    "parse_params",
+    "parse_typedef",
+    "parse_declarator",
+    "parse_type",
+    "parse_type_decl",
+    "parse_type_param",
+    "parse_tag_decl",
+    "parse_tag_type",
+    "parse_fields",
+    "parse_field",
+    "parse_enumerators",
+    "evaluate",
+    "is_hex",
+]
+
+
+def main(argv):
+    arg_parser = argparse.ArgumentParser(
+        description="Convert a C header to THAPI YAML."
+    )
+    arg_parser.add_argument("header", nargs="?", help="path to the header file")
+    arg_parser.add_argument(
+        "--yaml-backend",
+        choices=emitter.BACKENDS,
+        default="auto",
+        help="YAML emitter, auto picks libyaml when available (default: %(default)s)",
+    )
+    arg_parser.add_argument(
+        "--yaml-aliases",
+        action="store_true",
+        help="write each repeated leaf type (builtins, custom types, tags by name) "
+        "in full once, then as a YAML alias (not with --jobs, --watch, --serve or "
+        "--result-cache)",
     )
+    arg_parser.add_argument(
+        "--format",
+        choices=server.FORMATS,
+        default="yaml",
+        help="output format: YAML, or the compact binary encoding of "
+        "Common/binformat.py (not with --jobs or --watch) (default: %(default)s)",
+    )
+    arg_parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="write entities one by one instead of dumping the whole document at once",
+    )
+    arg_parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="convert the header in N worker processes, each handling byte ranges "
+        "of its top-level declarations; with --serve, the number of warm worker "
+        "processes (default: %(default)s)",
+    )
+    arg_parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="keep running and regenerate the output each time the header changes, "
+        "reparsing incrementally and converting only the declarations that changed",
+    )
+    arg_parser.add_argument(
+        "--interval",
+        type=float,
+        default=0.5,
+        help="seconds between checks of the header in --watch mode (default: %(default)s)",
+    )
+    arg_parser.add_argument(
+        "-o", "--output", help="output path (default: stdout), rewritten on each change"
+    )
+    arg_parser.add_argument(
+        "--result-cache",
+        help="directory caching the output of each header between runs; an "
+        "unchanged header is not parsed again",
+    )
+    arg_parser.add_argument(
+        "--result-cache-size",
+        type=int,
+        default=DEFAULT_MAX_BYTES >> 20,
+        help="size cap of the result cache in MiB (default: %(default)s)",
+    )
+    arg_parser.add_argument(
+        "--profile",
+        help="write call counts and times of the hot functions and per-phase wall "
+        "time and allocations to this JSON file, with a pstats dump next to it "
+        f"(not with --jobs or --watch; also enabled by ${instrument.ENV_VAR})",
+    )
+    arg_parser.add_argument(
+        "--serve",
+        nargs="?",
+        const="",
+        metavar="SOCKET",
+        help="run as a daemon answering parse requests on this Unix socket "
+        "(default: one per user) with --jobs warm worker processes; "
+        "Common/client.py is its client",
+    )
+    arg_parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        help="with --serve, exit after this many seconds without requests",
+    )
+    opts = arg_parser.parse_args(argv)
+    if opts.yaml_aliases and (
+        opts.jobs > 1 or opts.watch or opts.serve is not None or opts.result_cache
+    ):
+        arg_parser.error(
+            "--yaml-aliases dumps whole documents, without --jobs, --watch, --serve "
+            "or --result-cache"
+        )
+    try:
+        dumper = emitter.get_dumper(opts.yaml_backend, opts.yaml_aliases)
+    except ValueError as e:
+        arg_parser.error(str(e))
+    if opts.serve is not None:
+        result_cache = None
+        if opts.result_cache:
+            result_cache = make_result_cache(
+                opts.result_cache, opts.result_cache_size << 20
+            )
+        try:
+            server.serve(
+                opts.serve or server.default_socket_path("tree_sitter"),
+                "tree_sitter",
+                convert_request,
+                init_server_worker,
+                (result_cache, opts.yaml_backend),
+                jobs=opts.jobs,
+                idle_timeout=opts.idle_timeout,
+            )
+        except (RuntimeError, PermissionError) as e:
+            sys.exit(str(e))
+        return
+    if opts.header is None:
+        arg_parser.error("no header given")
+    if opts.format == "binary" and (opts.jobs > 1 or opts.watch):
+        arg_parser.error("--format binary converts serially, without --jobs or --watch")
+    if profile := instrument.output_path(opts.profile):
+        # Worker processes and --watch would leave the report empty
+        if opts.jobs > 1 or opts.watch:
+            arg_parser.error(
+                "--profile records serial runs only, not --jobs or --watch"
+            )
+        instrument.enable(globals(), PROFILED_FUNCTIONS)
+
+    if opts.watch:
+        try:
+            watch(opts.header, opts.output, dumper, opts.interval)
+        except KeyboardInterrupt:
+            pass
+        return
+
+    result_cache = None
+    if opts.result_cache:
+        result_cache = make_result_cache(
+            opts.result_cache, opts.result_cache_size << 20
+        )
+    if opts.format == "binary":
+        with (
+            open(opts.output, "wb") if opts.output else nullcontext(sys.stdout.buffer)
+        ) as out:
+            write_binary(opts.header, out, result_cache)
+    else:
+        with open(opts.output, "w") if opts.output else nullcontext(sys.stdout) as out:
+            write_header(opts.header, out, dumper, opts.stream, result_cache, opts.jobs)
+    if profile:
+        instrument.recorder.write(profile)
+
+
+def write_header(path, out, dumper, streaming=False, result_cache=None, jobs=1):
+    """Convert the header at path and write its YAML document to out."""
+    if result_cache:
+        if (document := result_cache.get_document(path)) is not None:
+            out.write(document)
+            return
+
+    with open(path, "rb") as file:
+        source = file.read()
+
+    if jobs > 1:
+        chunks = convert_parallel(
+            source, jobs, dumper, keep_entities=bool(result_cache)
+        )
+        if not result_cache:
+            emitter.write_entity_texts((text for text, _ in chunks), out)
+            return
+        chunks = list(chunks)
+        document = io.StringIO()
+        emitter.write_entity_texts((text for text, _ in chunks), document)
+        entities = [entity for _, chunk in chunks for entity in chunk]
+        result_cache.put(path, None, entities)
+        result_cache.put_document(path, None, document.getvalue())
+        out.write(document.getvalue())
+        return
+
+    with instrument.phase("parse"):
+        tree = tree_sitter.Parser(C_LANGUAGE).parse(source)
+    ctx = ParseContext(source)
+    if streaming and not result_cache:
+        # Entities are converted while they are dumped
+        with instrument.phase("convert_and_dump"):
+            emitter.write_translation_unit(
+                iter_translation_unit(ctx, tree.root_node), out, dumper
+            )
+        return
+    with instrument.phase("convert"):
+        d = parse_translation_unit(ctx, tree.root_node)
+    with instrument.phase("dump"):
+        if result_cache:
+            result_cache.put(path, None, d["entities"])
+            document = emitter.dump(d, dumper) + "\n"
+            result_cache.put_document(path, None, document)
+            out.write(document)
+        else:
+            emitter.write(d, out, dumper)
     # print(str(tree.root_node))    # Uncomment to print AST as an S-expression
+
+
+def write_binary(path, out, result_cache=None):
+    """Convert the header at path and write its binary document to out."""
+    entities = result_cache.get(path) if result_cache else None
+    if entities is None:
+        with open(path, "rb") as file:
+            source = file.read()
+        with instrument.phase("parse"):
+            tree = tree_sitter.Parser(C_LANGUAGE).parse(source)
+        with instrument.phase("convert"):
+            entities = list(iter_translation_unit(ParseContext(source), tree.root_node))
+        if result_cache:
+            result_cache.put(path, None, entities)
+    with instrument.phase("dump"):
+        out.write(binformat.dumps({"kind": "translation_unit", "entities": entities}))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
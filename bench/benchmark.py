@@ -0,0 +1,235 @@
+"""
+Benchmark both parsers over the unit_tests corpus, hip.hpp and synthetic headers.
+
+Each (parser, header) case runs in a fresh process and is timed per
+phase: parse (libclang Index.parse / tree-sitter Parser.parse), convert (AST
+to entity dicts) and dump (YAML). The peak RSS of that process, the time per
+entity and, for Clang, the number of libclang calls made per entity are
+recorded as well. Synthetic headers come from gen_header.py, with the same mix
+of constructs for both parsers, so per-entity cost can be followed as headers
+grow.
+
+    python3 bench/benchmark.py -o bench_results.json
+    python3 bench/benchmark.py --baseline bench_baseline.json --threshold 0.1
+
+Results are written as JSON; with --baseline the run fails (exit status 1)
+when a case got slower than the baseline by more than the threshold.
+"""
+
+import argparse
+import importlib.util
+import json
+import platform
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+
+from gen_header import generate_header
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+from Common.instrument import CallCounter
+
+UNIT_TESTS = ROOT / "unit_tests"
+# Compiler arguments needed by headers outside the plain C corpus
+CLANG_ARGS = {"hip.hpp": [f"-I{UNIT_TESTS}"], "namespace.h": ["-x", "c++"]}
+# Cases faster than this are too noisy to flag as regressions
+NOISE_FLOOR_S = 0.005
+
+
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_parser(parser):
+    if parser == "clang":
+        # Clang/parser.py imports its sibling modules as top-level ones
+        sys.path.insert(0, str(ROOT / "Clang"))
+        return load_module("clang_parser", ROOT / "Clang" / "parser.py")
+    return load_module("tree_sitter_parser", ROOT / "Tree_sitter" / "parser.py")
+
+
+def run_clang(module, header, args):
+    import clang.cindex
+
+    lib = clang.cindex.conf.lib
+    counter = clang.cindex.conf.lib = CallCounter(lib)
+    try:
+        index = clang.cindex.Index.create()
+        start = time.perf_counter()
+        tu = index.parse(str(header), args=args)
+        parse_s = time.perf_counter() - start
+        calls_before = counter.counts.total()
+        start = time.perf_counter()
+        ctx = module.ParseContext(tu)
+        d = module.parse_translation_unit(ctx, tu.cursor)
+        convert_s = time.perf_counter() - start
+        calls = counter.counts.total() - calls_before
+    finally:
+        clang.cindex.conf.lib = lib
+    return d, parse_s, convert_s, {"libclang_calls": calls}
+
+
+def run_tree_sitter(module, header, args):
+    source = header.read_bytes()
+    parser = module.tree_sitter.Parser(module.C_LANGUAGE)
+    start = time.perf_counter()
+    tree = parser.parse(source)
+    parse_s = time.perf_counter() - start
+    start = time.perf_counter()
+    d = module.parse_translation_unit(module.ParseContext(source), tree.root_node)
+    convert_s = time.perf_counter() - start
+    return d, parse_s, convert_s, {}
+
+
+RUNNERS = {"clang": run_clang, "tree_sitter": run_tree_sitter}
+
+
+def run_case(parser, header, args):
+    """Benchmark one case; meant to run in a process of its own."""
+    module = load_parser(parser)
+    result = {"parser": parser, "header": str(header)}
+    try:
+        d, parse_s, convert_s, extra = RUNNERS[parser](module, header, args)
+        start = time.perf_counter()
+        module.emitter.dump(d)
+        dump_s = time.perf_counter() - start
+        entities = len(d["entities"])
+        result |= {
+            "parse_s": parse_s,
+            "convert_s": convert_s,
+            "dump_s": dump_s,
+            "total_s": parse_s + convert_s + dump_s,
+            "entities": entities,
+        } | extra
+        result["us_per_entity"] = result["total_s"] * 1e6 / max(entities, 1)
+        if "libclang_calls" in extra:
+            result["libclang_calls_per_entity"] = extra["libclang_calls"] / max(
+                entities, 1
+            )
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}".splitlines()[0]
+    result["peak_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return result
+
+
+def best_of(runs):
+    """Keep the fastest run of a case; errors are kept as they are."""
+    ok = [r for r in runs if "error" not in r]
+    return min(ok, key=lambda r: r["total_s"]) if ok else runs[0]
+
+
+def compare(results, baseline, threshold):
+    """Return the cases of results slower than in baseline by more than threshold."""
+    base = {(r["parser"], Path(r["header"]).name): r for r in baseline["results"]}
+    regressions = []
+    for r in results:
+        b = base.get((r["parser"], Path(r["header"]).name))
+        if not b or "error" in r or "error" in b:
+            continue
+        if r["total_s"] > max(b["total_s"] * (1 + threshold), NOISE_FLOOR_S):
+            regressions.append((r, b))
+    return regressions
+
+
+def main(argv):
+    arg_parser = argparse.ArgumentParser(
+        description="Benchmark the THAPI header parsers."
+    )
+    arg_parser.add_argument(
+        "--parser",
+        choices=RUNNERS,
+        action="append",
+        help="parser to benchmark (default: both)",
+    )
+    arg_parser.add_argument(
+        "headers",
+        nargs="*",
+        type=Path,
+        help="headers to benchmark (default: unit_tests/*.h and hip.hpp)",
+    )
+    arg_parser.add_argument(
+        "--synthetic",
+        type=lambda s: [int(n) for n in s.split(",")],
+        default=[1000, 10000],
+        help="comma separated declaration counts of synthetic headers "
+        "(default: 1000,10000)",
+    )
+    arg_parser.add_argument(
+        "--seed", type=int, default=0, help="seed of the synthetic headers"
+    )
+    arg_parser.add_argument(
+        "--repeat", type=int, default=3, help="runs per case, the fastest is kept"
+    )
+    arg_parser.add_argument(
+        "-o", "--output", type=Path, default=Path("bench_results.json")
+    )
+    arg_parser.add_argument(
+        "--baseline", type=Path, help="results file to compare against"
+    )
+    arg_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="allowed slowdown ratio (default: %(default)s)",
+    )
+    opts = arg_parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        headers = opts.headers or sorted(UNIT_TESTS.glob("*.h")) + [
+            UNIT_TESTS / "hip.hpp"
+        ]
+        results = []
+        # A fresh process per case keeps peak RSS and libclang state separate
+        with ProcessPoolExecutor(
+            1, mp_context=get_context("spawn"), max_tasks_per_child=1
+        ) as pool:
+            for parser in opts.parser or list(RUNNERS):
+                synthetic = [
+                    generate_header(Path(tmp) / f"synthetic_{n}.h", n, opts.seed)
+                    for n in opts.synthetic
+                    if n
+                ]
+                for header in headers + synthetic:
+                    args = CLANG_ARGS.get(header.name, [])
+                    runs = [
+                        pool.submit(run_case, parser, header, args)
+                        for _ in range(opts.repeat)
+                    ]
+                    r = best_of([run.result() for run in runs])
+                    results.append(r)
+                    status = (
+                        r.get("error")
+                        or f"{r['total_s'] * 1000:.1f} ms, {r['entities']} entities"
+                    )
+                    print(f"{parser:12} {header.name:32} {status}", file=sys.stderr)
+
+    report = {
+        "meta": {"python": platform.python_version(), "machine": platform.machine()},
+        "results": results,
+    }
+    opts.output.write_text(json.dumps(report, indent=1) + "\n")
+
+    if opts.baseline:
+        regressions = compare(
+            results, json.loads(opts.baseline.read_text()), opts.threshold
+        )
+        for r, b in regressions:
+            print(
+                f"REGRESSION {r['parser']} {Path(r['header']).name}: "
+                f"{b['total_s'] * 1000:.1f} ms -> {r['total_s'] * 1000:.1f} ms",
+                file=sys.stderr,
+            )
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,161 @@
+"""
+Generate large synthetic C headers for scaling tests.
+
+The declarations mix the constructs the parsers handle: functions with many
+(multi-level pointer and array) parameters, plain and pointer typedefs,
+structs and unions with nested records and 2D arrays, and typedef'd enums with
+decimal, negative and hex values. Output is fully determined by the seed.
+
+    python3 bench/gen_header.py --decls 20000 --seed 0 -o big.h
+    python3 bench/gen_header.py --decls 5000 --profile tree_sitter -o small.h
+
+--profile tree_sitter restricts the mix to functions with scalar and pointer
+parameters and typedefs, the constructs of the first Tree-sitter parser.
+"""
+
+import argparse
+import random
+import sys
+from pathlib import Path
+
+PRIMITIVES = [
+    "int",
+    "unsigned int",
+    "short",
+    "unsigned short",
+    "long",
+    "unsigned long",
+    "long long",
+    "unsigned long long",
+    "char",
+    "signed char",
+    "unsigned char",
+    "float",
+    "double",
+    "long double",
+]
+
+
+class HeaderGenerator:
+    def __init__(self, seed=0, profile="clang"):
+        self.rng = random.Random(seed)
+        self.profile = profile
+        self.types = list(PRIMITIVES)  # grows with the typedefs emitted so far
+        self.count = 0
+
+    def name(self, prefix):
+        self.count += 1
+        return f"{prefix}{self.count}"
+
+    def type_name(self):
+        return self.rng.choice(self.types)
+
+    def stars(self, most=3):
+        return "*" * self.rng.randint(0, most)
+
+    def array(self):
+        match self.rng.randint(0, 5):
+            case 0:
+                return f"[{self.rng.randint(1, 64)}]"
+            case 1:
+                return f"[{self.rng.randint(1, 8)}][{self.rng.randint(1, 8)}]"
+            case _:
+                return ""
+
+    def function(self):
+        params = []
+        for i in range(self.rng.randint(0, 12)):
+            if self.profile == "clang" and self.rng.random() < 0.2:
+                params.append(f"{self.type_name()} p{i}[{self.rng.randint(1, 16)}]")
+            else:
+                params.append(f"{self.type_name()} {self.stars()}p{i}")
+        name = self.name("func")
+        return f"{self.type_name()} {self.stars(2)}{name}({', '.join(params)});"
+
+    def typedef(self):
+        name = self.name("type")
+        decl = f"typedef {self.type_name()} {self.stars()}{name};"
+        self.types.append(name)
+        return decl
+
+    def fields(self, depth):
+        lines = []
+        for i in range(self.rng.randint(1, 8)):
+            if depth < 2 and self.rng.random() < 0.15:
+                lines.append(f"{self.record(depth + 1)} {self.stars(1)}m{i};")
+            else:
+                field = f"{self.stars(2)}m{i}{self.array()}"
+                lines.append(f"{self.type_name()} {field};")
+        return " ".join(lines)
+
+    def record(self, depth=0):
+        kind = self.rng.choice(["struct", "union"])
+        tag = f" {self.name(kind)}" if depth == 0 or self.rng.random() < 0.5 else ""
+        return f"{kind}{tag} {{ {self.fields(depth)} }}"
+
+    def record_decl(self):
+        if self.rng.random() < 0.5:
+            return self.record() + ";"
+        name = self.name("rec")
+        decl = f"typedef {self.record()} {name};"
+        self.types.append(name)
+        return decl
+
+    def enum(self):
+        members = []
+        for i in range(self.rng.randint(1, 16)):
+            value = self.rng.randint(-(2**15), 2**15)
+            match self.rng.randint(0, 2):
+                case 0:
+                    literal = f"{value}"
+                case 1:
+                    literal = f"0x{abs(value):x}" if value >= 0 else f"-0x{-value:x}"
+                case _:
+                    literal = f"0X{abs(value):X}"
+            members.append(f"E{self.count}_{i} = {literal}")
+        name = self.name("enum")
+        decl = f"typedef enum {name}_enum {{ {', '.join(members)} }} {name};"
+        self.types.append(name)
+        return decl
+
+    def generate(self, n_decls):
+        if self.profile == "clang":
+            makers = [self.function, self.typedef, self.record_decl, self.enum]
+            weights = [4, 2, 2, 1]
+        else:
+            makers = [self.function, self.typedef]
+            weights = [2, 1]
+        for _ in range(n_decls):
+            yield self.rng.choices(makers, weights)[0]()
+
+
+def generate_header(path, n_decls, seed=0, profile="clang"):
+    """Write a synthetic header of n_decls top-level declarations to path."""
+    path = Path(path)
+    with open(path, "w") as f:
+        for decl in HeaderGenerator(seed, profile).generate(n_decls):
+            f.write(decl + "\n")
+    return path
+
+
+def main(argv):
+    arg_parser = argparse.ArgumentParser(description="Generate a synthetic C header.")
+    arg_parser.add_argument("--decls", type=int, default=10000)
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument(
+        "--profile",
+        choices=["clang", "tree_sitter"],
+        default="clang",
+        help="constructs to emit, tree_sitter keeps to functions and typedefs",
+    )
+    arg_parser.add_argument("-o", "--output", help="output path (default: stdout)")
+    opts = arg_parser.parse_args(argv)
+    if opts.output:
+        generate_header(opts.output, opts.decls, opts.seed, opts.profile)
+    else:
+        for decl in HeaderGenerator(opts.seed, opts.profile).generate(opts.decls):
+            print(decl)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
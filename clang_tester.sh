@@ -1,24 +1,33 @@
 #!/bin/bash
 ret=0
-for header in ./unit_tests/*.h; do
-    echo $header
-    name=$(basename $header .h)
-    outpath="./unit_tests/ruby_out/$name.out"
-    if test -f $outpath; then
-        python3 Clang/parser.py $header > clang.out
-        if ! diff $outpath clang.out
-        then
-        ((ret += 1))
-        fi
-    else
-        ruby emit_yaml.rb $header > ruby.out
-        python3 Clang/parser.py $header > clang.out
-        if ! diff ruby.out clang.out
-        then
-        ((ret += 1))
-        fi
-    fi
-done
-echo number of cases failed:
+# Convert every header in-process and compare the entities with the Ruby
+# references (unit_tests/ruby_out or the cached emit_yaml.rb output)
+if ! python3 -m Common.conformance --parser clang --jobs "$(nproc)" ./unit_tests/*.h
+then
+((ret += 1))
+fi
+# A large synthetic header must convert without errors
+echo synthetic.h
+outdir=$(mktemp -d)
+trap 'rm -rf "$outdir"' EXIT
+python3 bench/gen_header.py --decls 2000 --seed 0 -o "$outdir/synthetic.h"
+if ! python3 Clang/parser.py "$outdir/synthetic.h" > /dev/null
+then
+((ret += 1))
+fi
+# Refreshing a result-cache entry (here by a binary run after an included
+# header changed) must drop its stale YAML document
+echo result_cache
+cache="$outdir/cache"
+printf 'int f(int a);\n' > "$outdir/a.h"
+printf '#include "a.h"\nint h(void);\n' > "$outdir/h.h"
+python3 Clang/parser.py --result-cache "$cache" "$outdir/h.h" > /dev/null
+printf 'int f(int a);\nint g(void);\n' > "$outdir/a.h"
+python3 Clang/parser.py --result-cache "$cache" --format binary "$outdir/h.h" > /dev/null
+if ! python3 Clang/parser.py --result-cache "$cache" "$outdir/h.h" | grep -q "name: g"
+then
+((ret += 1))
+fi
+echo number of checks failed:
 echo $ret
 exit $ret
@@ -1,9 +1,30 @@
-#!/bin/bash -e
-
+#!/bin/bash
+ret=0
+# C++ cases the C grammar cannot parse (attributes, namespaces)
+unsupported="attributes.h namespace.h"
+headers=()
 for header in ./unit_tests/*.h; do
-    echo $header
-    ruby emit_yaml.rb $header > ruby.out
-    python3 Tree_sitter/parser.py $header > ts.out
-    diff ruby.out ts.out
+    if [[ " $unsupported " != *" $(basename "$header") "* ]]; then
+        headers+=("$header")
+    fi
 done
-
+# Convert every header in-process and compare the entities with the Ruby
+# references (unit_tests/ruby_out or the cached emit_yaml.rb output)
+if ! python3 -m Common.conformance --parser tree_sitter --jobs "$(nproc)" "${headers[@]}"
+then
+((ret += 1))
+fi
+# A large synthetic header must give the same output as the Clang parser
+echo synthetic.h
+outdir=$(mktemp -d)
+trap 'rm -rf "$outdir"' EXIT
+python3 bench/gen_header.py --decls 2000 --seed 0 -o "$outdir/synthetic.h"
+python3 Clang/parser.py "$outdir/synthetic.h" > "$outdir/clang.out"
+python3 Tree_sitter/parser.py "$outdir/synthetic.h" > "$outdir/ts.out"
+if ! diff "$outdir/clang.out" "$outdir/ts.out"
+then
+((ret += 1))
+fi
+echo number of checks failed:
+echo $ret
+exit $ret